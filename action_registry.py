@@ -0,0 +1,93 @@
+import os
+import ast
+import sys
+import json
+import time
+import logging
+import importlib
+from functools import lru_cache
+
+ACTIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "actions")
+
+# Pillow format plugins that handle each input extension; everything else stays unimported
+IMAGE_PLUGINS = {
+    '.png': 'PngImagePlugin',
+    '.jpg': 'JpegImagePlugin',
+    '.jpeg': 'JpegImagePlugin',
+    '.webp': 'WebPImagePlugin',
+    '.avif': 'AvifImagePlugin',
+    '.gif': 'GifImagePlugin',
+    '.bmp': 'BmpImagePlugin',
+    '.tif': 'TiffImagePlugin',
+    '.tiff': 'TiffImagePlugin'
+}
+
+@lru_cache(maxsize=None)
+def discover_entry_points():
+    # Reads actions/*.py with ast instead of importing them, so Pillow and PyPDF2 stay unloaded
+    entry_points = {}
+    for file_name in sorted(os.listdir(ACTIONS_DIRECTORY)):
+        if not file_name.endswith(".py") or file_name.startswith("_"):
+            continue
+        module_name = f"actions.{file_name[:-3]}"
+        try:
+            with open(os.path.join(ACTIONS_DIRECTORY, file_name), 'r', encoding='utf-8') as f:
+                tree = ast.parse(f.read(), filename=file_name)
+        except (OSError, SyntaxError) as e:
+            logging.error(f"Error reading action module {module_name}: {str(e)}")
+            continue
+        entry_points[module_name] = {node.name for node in tree.body if isinstance(node, ast.FunctionDef) and not node.name.startswith("_")}
+    return entry_points
+
+def is_registered(action_details):
+    return action_details.function in discover_entry_points().get(action_details.module, set())
+
+def get_registered_actions(actions):
+    return [action for action in actions if action.module and is_registered(action)]
+
+def load_action(action_details):
+    if not is_registered(action_details):
+        raise ValueError(f"Action {action_details.module}.{action_details.function} was not found in {ACTIONS_DIRECTORY}")
+    module = importlib.import_module(action_details.module)
+    return getattr(module, action_details.function)
+
+def register_image_plugins(extensions):
+    # Importing a plugin registers it with Pillow, so Image.open/save never fall back to Image.init(),
+    # which imports every *ImagePlugin module
+    for extension in extensions:
+        plugin = IMAGE_PLUGINS.get(extension.lower())
+        if plugin is None:
+            continue
+        try:
+            importlib.import_module(f"PIL.{plugin}")
+        except ImportError:
+            logging.debug(f"Pillow plugin {plugin} is not available")
+
+
+class StartupProfile:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.enabled = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append({"phase": phase, "ms": round((now - self.last) * 1000, 2)})
+        self.last = now
+
+    def report(self):
+        pillow_plugins = sorted(name.split(".")[-1] for name in sys.modules if name.startswith("PIL.") and name.endswith("ImagePlugin"))
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "phases": self.phases,
+            "modules_loaded": len(sys.modules),
+            "pillow_plugins": pillow_plugins,
+            "inquirerpy_loaded": "InquirerPy" in sys.modules,
+            "pypdf2_loaded": "PyPDF2" in sys.modules
+        }
+
+    def print_report(self):
+        if self.enabled:
+            # stderr keeps stdout free for the headless JSON summary
+            print(json.dumps({"startup_profile": self.report()}), file=sys.stderr)
@@ -1,85 +1,341 @@
 import os
+import io
+import re
 import logging
+import struct
+import zlib
+from functools import partial
 from PIL import Image
-from PyPDF2 import PdfMerger
-from file_utils import get_files_to_process
+from file_utils import get_files_to_process, get_temp_path, atomic_output
+from action_registry import register_image_plugins
+from manifest import Manifest, hash_params
+from pipeline import run_pipeline, read_file
+from metrics import timer, count
+from encoding import save_image, get_encoder_options
+from dedup import find_duplicates
+from config import (
+    DEFAULT_MERGE_STREAMING,
+    DEFAULT_MAX_TILE_SIZE,
+    DEFAULT_INCREMENTAL,
+    DEFAULT_PDF_MAX_PART_SIZE,
+    DEFAULT_PDF_DEDUP_RESOURCES,
+    DEFAULT_PIPELINE,
+    DEFAULT_PIPELINE_IN_FLIGHT,
+    DEFAULT_ENCODER_PRESET,
+    DEFAULT_MERGE_DEDUP,
+    IMAGE_EXTENSIONS,
+    PDF_EXTENSIONS
+)
 
+PNG_IDAT_SIZE = 1 << 20
 
-def merge_files(directory, matrix="1,1", fill_method="stretch", include_subdirectories=True):
+register_image_plugins(IMAGE_EXTENSIONS)
+
+
+def merge_files(directory, matrix="1,1", fill_method="stretch", include_subdirectories=True, streaming=DEFAULT_MERGE_STREAMING, max_tile_size=DEFAULT_MAX_TILE_SIZE, incremental=DEFAULT_INCREMENTAL, page_ranges="", max_part_size=DEFAULT_PDF_MAX_PART_SIZE, dedup_resources=DEFAULT_PDF_DEDUP_RESOURCES, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, encoder_preset=DEFAULT_ENCODER_PRESET, dedup=DEFAULT_MERGE_DEDUP):
     
     try:
-        files_to_process = get_files_to_process(directory, include_subdirectories)
-        pdfs = sorted([file for file in files_to_process if file.lower().endswith('.pdf')])
-        images = sorted([file for file in files_to_process if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))])
+        files_to_process = get_files_to_process(directory, include_subdirectories, skip_generated=True, extensions=IMAGE_EXTENSIONS + PDF_EXTENSIONS)
+        pdfs = sorted([file for file in files_to_process if file.lower().endswith(PDF_EXTENSIONS)])
+        images = sorted([file for file in files_to_process if file.lower().endswith(IMAGE_EXTENSIONS)])
+        manifest = Manifest(directory) if incremental or dedup else None
+        if dedup:
+            # Identical inputs would only repeat pages and tiles, so every content is merged once
+            pdfs, _ = find_duplicates(pdfs, manifest)
+            images, _ = find_duplicates(images, manifest)
 
         if pdfs:
-            merge_pdfs(pdfs, directory)
+            params = {"page_ranges": page_ranges, "max_part_size": max_part_size, "dedup_resources": dedup_resources}
+            output_pdf = get_pdf_part_path(directory, 1)
+            if incremental and is_merge_current(manifest, "merge_pdfs", pdfs, params, [output_pdf]):
+                logging.info(f"PDF inputs unchanged, keeping {output_pdf}")
+            else:
+                merge_pdfs(pdfs, directory, page_ranges, max_part_size, dedup_resources)
+                record_merge(manifest, "merge_pdfs", pdfs, params)
         if images:
-            merge_images(images, directory, matrix, fill_method)
-        
+            params = {"matrix": matrix, "fill_method": fill_method, "streaming": streaming, "max_tile_size": max_tile_size, "encoder_preset": encoder_preset}
+            output_image = os.path.join(directory, "merged_image.png" if streaming else "merged_image.jpg")
+            if incremental and is_merge_current(manifest, "merge_images", images, params, [output_image]):
+                logging.info(f"Image inputs unchanged, keeping {output_image}")
+            else:
+                merge_images(images, directory, matrix, fill_method, streaming, max_tile_size, pipeline, in_flight, encoder_preset)
+                record_merge(manifest, "merge_images", images, params)
+
+        if manifest:
+            manifest.save()
         return True, False
     except Exception as e:
         logging.error(f"Error merging files: {str(e)}")
         return False, True
 
-def merge_pdfs(pdfs, output_directory):
+def is_merge_current(manifest, action, inputs, params, outputs):
+    if manifest is None:
+        return False
+    digest = manifest.inputs_digest(inputs, hash_params(action, params))
+    return manifest.is_aggregate_current(action, digest, outputs)
+
+def record_merge(manifest, action, inputs, params):
+    if manifest is not None:
+        manifest.record_aggregate(action, manifest.inputs_digest(inputs, hash_params(action, params)))
+
+def get_pdf_part_path(output_directory, part):
+    if part == 1:
+        return os.path.join(output_directory, "merged_file.pdf")
+    return os.path.join(output_directory, f"merged_file_part{part}.pdf")
+
+def merge_pdfs(pdfs, output_directory, page_ranges="", max_part_size=DEFAULT_PDF_MAX_PART_SIZE, dedup_resources=DEFAULT_PDF_DEDUP_RESOURCES):
+    # PyPDF2 is slow to import, so it is only loaded when there are PDFs to merge
+    from pdf_utils import StreamingPdfWriter, open_pdf, parse_page_ranges, parse_page_range_map
+    range_map = parse_page_range_map(page_ranges)
+    max_part_bytes = max_part_size * 1024 * 1024
+    writer = None
+    part = 1
+    # Parts are written under temporary names and only renamed once every part is complete,
+    # so a failed or interrupted merge keeps the previous merged file(s)
+    finished = []
+    deduplicated = 0
     try:
-        merger = PdfMerger()
         for pdf in pdfs:
-            merger.append(pdf)
-        output_pdf = os.path.join(output_directory, "merged_file.pdf")
-        merger.write(output_pdf)
-        merger.close()
-        logging.info(f"Merged PDF saved as {output_pdf}")
+            ranges = range_map.get(pdf, range_map.get(os.path.basename(pdf), ""))
+            # Inputs are opened one at a time, so only a single input file handle is ever open
+            handle, reader = open_pdf(pdf)
+            try:
+                for page_index in parse_page_ranges(ranges, len(reader.pages)):
+                    if writer is None:
+                        writer = StreamingPdfWriter(get_temp_path(get_pdf_part_path(output_directory, part)), dedup_resources)
+                    with timer("pdf_copy"):
+                        writer.add_page_from(reader, page_index)
+                    count("merge_pdfs", "pages")
+                    # Split the output into parts once the current one reaches the size cap
+                    if max_part_bytes and writer.tell() >= max_part_bytes:
+                        writer.close()
+                        finished.append(writer.path)
+                        deduplicated += writer.deduplicated
+                        writer = None
+                        part += 1
+                if writer is not None:
+                    writer.forget_reader(reader)
+            finally:
+                handle.close()
+            count("merge_pdfs", "files")
+            count("merge_pdfs", "bytes", os.path.getsize(pdf))
+        if writer is not None:
+            writer.close()
+            finished.append(writer.path)
+            deduplicated += writer.deduplicated
+            writer = None
     except Exception as e:
+        if writer is not None:
+            writer.abort()
+        for temp_path in finished:
+            os.remove(temp_path)
+        count("merge_pdfs", "errors")
         logging.error(f"Error merging PDFs: {str(e)}")
         raise
 
-def merge_images(images, output_directory, matrix, fill_method):
-    try:
-        rows, cols = map(int, matrix.split(','))
-        num_images = len(images)
-
-        # Get the maximum width and height of the images
-        max_width = max(Image.open(image).width for image in images)
-        max_height = max(Image.open(image).height for image in images)
+    outputs = []
+    for part, temp_path in enumerate(finished, 1):
+        outputs.append(get_pdf_part_path(output_directory, part))
+        os.replace(temp_path, outputs[-1])
+    remove_stale_parts(output_directory, len(outputs))
+    logging.info(f"Merged PDF saved as {', '.join(outputs)} ({deduplicated} duplicate resources shared)")
+    return outputs
 
-        # Calculate the size of the new image
-        new_width = max_width * cols
-        new_height = max_height * rows
+def remove_stale_parts(output_directory, part_count):
+    # An earlier merge may have been split into more parts than this one
+    for name in os.listdir(output_directory):
+        match = re.fullmatch(r"merged_file_part(\d+)\.pdf", name)
+        if match and int(match.group(1)) > part_count:
+            os.remove(os.path.join(output_directory, name))
+            logging.info(f"Removed {name} left over from an earlier merge")
 
-        new_im = Image.new('RGB', (new_width, new_height), (255, 255, 255))
+def merge_images(images, output_directory, matrix, fill_method, streaming=DEFAULT_MERGE_STREAMING, max_tile_size=DEFAULT_MAX_TILE_SIZE, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, encoder_preset=DEFAULT_ENCODER_PRESET):
+    try:
+        rows, cols = map(int, matrix.split(','))
+        images = images[:rows * cols]
 
-        x_offset = 0
-        y_offset = 0
-        for index, image_path in enumerate(images):
-            if index > 0 and index % cols == 0:
-                x_offset = 0
-                y_offset += max_height
+        # Only image headers are read here, pixel data is decoded later one tile at a time
+        sizes = [get_image_size(image) for image in images]
+        max_width = max(width for width, _ in sizes)
+        max_height = max(height for _, height in sizes)
 
-            im = Image.open(image_path)
-            new_im.paste(im, (x_offset, y_offset))
-            x_offset += max_width
+        # Downscale every tile by the same factor so the grid keeps its proportions
+        scale = 1.0
+        if max_tile_size and max(max_width, max_height) > max_tile_size:
+            scale = max_tile_size / max(max_width, max_height)
+        cell_size = (max(1, round(max_width * scale)), max(1, round(max_height * scale)))
 
-        # Handle the last row if the images don't fill the grid exactly
-        remaining = num_images % cols
-        if remaining != 0:
-            gap_width = new_width - x_offset
-            last_image = Image.open(images[-1])
-
-            if fill_method == "stretch":
-                stretched = last_image.resize((gap_width, max_height))
-                new_im.paste(stretched, (x_offset, y_offset))
-            elif fill_method == "repeat":
-                for i in range(cols - remaining):
-                    new_im.paste(last_image, (x_offset, y_offset))
-                    x_offset += max_width
-            elif fill_method == "leave":
-                pass
-
-        output_image = os.path.join(output_directory, "merged_image.jpg")
-        new_im.save(output_image)
+        if streaming:
+            output_image = os.path.join(output_directory, "merged_image.png")
+            compositor = GridCompositor(rows, cols, cell_size, fill_method)
+            compress_level = get_encoder_options("png", encoder_preset)["compress_level"]
+            with PngStreamWriter(output_image, compositor.size, compress_level) as writer:
+                compositor.sink = writer.write_band
+                add_tiles(compositor, images, scale, pipeline, in_flight)
+                compositor.finish()
+        else:
+            output_image = os.path.join(output_directory, "merged_image.jpg")
+            compositor = GridCompositor(rows, cols, cell_size, fill_method)
+            new_im = Image.new('RGB', compositor.size, (255, 255, 255))
+            compositor.sink = lambda band, y_offset: new_im.paste(band, (0, y_offset))
+            add_tiles(compositor, images, scale, pipeline, in_flight)
+            compositor.finish()
+            with timer("encode"), atomic_output(output_image) as temp_path:
+                save_image(new_im, temp_path, "jpeg", encoder_preset)
+        count("merge_images", "files", len(images))
         logging.info(f"Merged image saved as {output_image}")
     except Exception as e:
+        count("merge_images", "errors")
         logging.error(f"Error merging images: {str(e)}")
         raise
+
+def add_tiles(compositor, images, scale, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT):
+    if not pipeline:
+        for image_path in images:
+            compositor.add(load_tile(image_path, scale))
+        return
+    # Tiles are read and decoded ahead on worker threads while earlier bands are being encoded;
+    # the compositor needs them in grid order, so the pipeline keeps input order
+    results = run_pipeline(images, read_file, partial(decode_tile, scale=scale), lambda image_path, tile: compositor.add(tile), in_flight=in_flight, ordered=True)
+    failed = [result for result in results if not result.success]
+    if failed:
+        raise ValueError(f"Could not load {failed[0].path}: {failed[0].error}")
+
+def decode_tile(image_path, data, scale=1.0):
+    return load_tile(io.BytesIO(data), scale)
+
+def get_image_size(image_path):
+    with Image.open(image_path) as im:
+        return im.size
+
+def load_tile(image_path, scale=1.0):
+    with timer("decode"):
+        return _load_tile(image_path, scale)
+
+def _load_tile(image_path, scale):
+    with Image.open(image_path) as im:
+        if scale >= 1.0:
+            return im.convert('RGB')
+        target = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+        # JPEG can decode straight to a reduced scale, other formats ignore draft()
+        im.draft('RGB', target)
+        tile = im.convert('RGB')
+    if tile.size != target:
+        tile = tile.resize(target, Image.LANCZOS, reducing_gap=3.0)
+    return tile
+
+class GridCompositor:
+    # Composites tiles one row band at a time and hands every finished band to sink(band, y_offset)
+    def __init__(self, rows, cols, cell_size, fill_method, sink=None):
+        self.rows = rows
+        self.cols = cols
+        self.cell_width, self.cell_height = cell_size
+        self.size = (self.cell_width * cols, self.cell_height * rows)
+        self.fill_method = fill_method
+        self.sink = sink
+        self.row = 0
+        self.column = 0
+        self.band = None
+        self.last_tile = None
+
+    def add(self, tile):
+        if self.row >= self.rows:
+            return
+        if self.band is None:
+            self.band = self._new_band()
+        self.band.paste(tile, (self.column * self.cell_width, 0))
+        self.last_tile = tile
+        self.column += 1
+        if self.column == self.cols:
+            self._flush()
+
+    def finish(self):
+        # Handle the last row if the images don't fill the grid exactly
+        if self.band is not None:
+            self._fill_last_row()
+            self._flush()
+        while self.row < self.rows:
+            self.band = self._new_band()
+            self._flush()
+
+    def _fill_last_row(self):
+        x_offset = self.column * self.cell_width
+        if self.fill_method == "stretch":
+            gap_width = self.size[0] - x_offset
+            self.band.paste(self.last_tile.resize((gap_width, self.cell_height)), (x_offset, 0))
+        elif self.fill_method == "repeat":
+            for _ in range(self.cols - self.column):
+                self.band.paste(self.last_tile, (x_offset, 0))
+                x_offset += self.cell_width
+
+    def _new_band(self):
+        return Image.new('RGB', (self.size[0], self.cell_height), (255, 255, 255))
+
+    def _flush(self):
+        self.sink(self.band, self.row * self.cell_height)
+        self.band = None
+        self.column = 0
+        self.row += 1
+
+class PngStreamWriter:
+    # Minimal PNG encoder that writes scanlines as they arrive, so the full canvas never exists in memory.
+    # It streams into a temporary file that only replaces path once the image is complete.
+    def __init__(self, path, size, compress_level=6):
+        self.path = path
+        self.temp_path = get_temp_path(path)
+        self.width, self.height = size
+        self.compress_level = compress_level
+        self.file = None
+        self.compressor = None
+        self.buffer = []
+        self.buffered = 0
+
+    def __enter__(self):
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8-bit RGB, no interlacing
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+        self.compressor = zlib.compressobj(self.compress_level)
+        return self
+
+    def write_band(self, band, y_offset):
+        with timer("encode"):
+            data = band.tobytes()
+            row_bytes = self.width * 3
+            # Every scanline is prefixed with filter type 0 (none)
+            scanlines = b''.join(b'\x00' + data[offset:offset + row_bytes] for offset in range(0, len(data), row_bytes))
+            self._queue(self.compressor.compress(scanlines))
+
+    def _queue(self, data):
+        if data:
+            self.buffer.append(data)
+            self.buffered += len(data)
+        if self.buffered >= PNG_IDAT_SIZE:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self.buffer:
+            self._write_chunk(b'IDAT', b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        complete = False
+        try:
+            if exc_type is None:
+                self._queue(self.compressor.flush())
+                self._flush_idat()
+                self._write_chunk(b'IEND', b'')
+                complete = True
+        finally:
+            self.file.close()
+            if complete:
+                os.replace(self.temp_path, self.path)
+            elif os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
@@ -1,23 +1,212 @@
 import logging
 import os
+import csv
 import json
-from file_utils import get_files_to_process, get_metadata
+from functools import partial
+from file_utils import iter_files, get_metadata, hash_file, check_hash_algorithm, atomic_output
+from executor import iter_results
+from manifest import Manifest, hash_params
+from action_registry import register_image_plugins
+from metrics import timer, count
+from config import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_INCREMENTAL,
+    DEFAULT_METADATA_FORMAT,
+    DEFAULT_METADATA_WORKERS,
+    DEFAULT_HASH_ALGORITHM,
+    IMAGE_EXTENSIONS,
+    PDF_EXTENSIONS
+)
 
-def copy_metadata(directory, **kwargs):
+METADATA_COLUMNS = ["path", "size", "modified_time", "created_time"]
+MEDIA_COLUMNS = ["format", "width", "height", "mode", "pages"]
+OUTPUT_EXTENSIONS = {"json": "json", "ndjson": "ndjson", "csv": "csv", "parquet": "parquet"}
+PARQUET_BATCH_SIZE = 10000
+
+def copy_metadata(directory, include_subdirectories=True, workers=DEFAULT_METADATA_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, incremental=DEFAULT_INCREMENTAL, output_format=DEFAULT_METADATA_FORMAT, include_hash=False, hash_algorithm=DEFAULT_HASH_ALGORITHM, include_media_info=False, **kwargs):
     try:
-        files_to_process = get_files_to_process(directory)
-        metadata_list = []
-        
-        for file in files_to_process:
-            metadata = get_metadata(file)
-            metadata_list.append(metadata)
-        
-        output_file = os.path.join(directory, "metadata.json")
-        with open(output_file, 'w') as f:
-            json.dump(metadata_list, f)
-        
-        logging.info(f"Metadata copied to {output_file}")
-        return True, False
+        # Checked up front, so a bad setting never replaces the previous export with an empty one
+        if output_format not in OUTPUT_EXTENSIONS:
+            raise ValueError(f"Unsupported metadata format: {output_format}")
+        if output_format == "parquet":
+            import_pyarrow()
+        if include_hash:
+            check_hash_algorithm(hash_algorithm)
+        output_file = os.path.join(directory, f"metadata.{OUTPUT_EXTENSIONS[output_format]}")
+        files_to_process = iter_files(directory, include_subdirectories, skip_generated=True)
+
+        manifest = Manifest(directory) if incremental else None
+        if manifest:
+            files_to_process = list(files_to_process)
+            params_hash = hash_params("copy_metadata", {"format": output_format, "hash": hash_algorithm if include_hash else None, "media": include_media_info})
+            digest = manifest.inputs_digest(files_to_process, params_hash)
+            if manifest.is_aggregate_current("copy_metadata", digest, [output_file]):
+                logging.info(f"No files changed, keeping {output_file}")
+                return True, False
+
+        columns = list(METADATA_COLUMNS)
+        if include_hash:
+            columns.append(hash_algorithm)
+        if include_media_info:
+            columns.extend(MEDIA_COLUMNS)
+
+        # Stat calls are I/O bound (especially on network shares), so a thread pool overlaps their latency
+        task = partial(build_metadata_record, include_hash=include_hash, hash_algorithm=hash_algorithm, include_media_info=include_media_info)
+        written = 0
+        failed = 0
+        with atomic_output(output_file) as temp_file, open_metadata_writer(temp_file, output_format, columns) as writer:
+            for result in iter_results(task, files_to_process, workers, chunk_size, use_threads=True):
+                if not result.success:
+                    failed += 1
+                    logging.error(f"Error reading metadata for {result.path}: {result.error}")
+                    continue
+                with timer("write"):
+                    writer.write(result.value)
+                written += 1
+        count("copy_metadata", "files", written)
+        count("copy_metadata", "errors", failed)
+
+        if manifest and not failed:
+            manifest.record_aggregate("copy_metadata", digest)
+            manifest.save()
+        logging.info(f"Metadata of {written} files copied to {output_file}, {failed} failed")
+        return failed == 0, failed > 0
     except Exception as e:
         logging.error(f"Error copying metadata: {str(e)}")
         return False, True
+
+def build_metadata_record(file, include_hash=False, hash_algorithm=DEFAULT_HASH_ALGORITHM, include_media_info=False):
+    path = os.fspath(file)
+    record = {"path": path}
+    with timer("stat"):
+        record.update(get_metadata(file))
+    if include_hash:
+        record[hash_algorithm] = hash_file(path, hash_algorithm)
+    if include_media_info:
+        with timer("media_info"):
+            record.update(get_media_info(path))
+    count("copy_metadata", "bytes", record.get("size", 0))
+    return record
+
+def get_media_info(path):
+    # Only headers are read here, image pixels and PDF page content are never decoded
+    lower_path = path.lower()
+    try:
+        # Pillow and PyPDF2 are only imported once media info is actually requested
+        if lower_path.endswith(IMAGE_EXTENSIONS):
+            from PIL import Image
+            register_image_plugins(IMAGE_EXTENSIONS)
+            with Image.open(path) as im:
+                return {"format": im.format, "width": im.width, "height": im.height, "mode": im.mode}
+        if lower_path.endswith(PDF_EXTENSIONS):
+            from PyPDF2 import PdfReader
+            # Passing an open file keeps PdfReader from loading the whole document into memory
+            with open(path, 'rb') as f:
+                reader = PdfReader(f)
+                return {"format": "PDF", "pages": int(reader.trailer["/Root"]["/Pages"]["/Count"])}
+    except Exception as e:
+        logging.warning(f"Could not read media info for {path}: {str(e)}")
+    return {}
+
+def open_metadata_writer(output_file, output_format, columns):
+    if output_format == "ndjson":
+        return NdjsonMetadataWriter(output_file)
+    if output_format == "csv":
+        return CsvMetadataWriter(output_file, columns)
+    if output_format == "parquet":
+        return ParquetMetadataWriter(output_file, columns)
+    return JsonMetadataWriter(output_file)
+
+class NdjsonMetadataWriter:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.output_file, 'w')
+        return self
+
+    def write(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write("\n")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+class JsonMetadataWriter(NdjsonMetadataWriter):
+    # Writes the same JSON array as before, one element at a time
+    def __enter__(self):
+        super().__enter__()
+        self.file.write("[")
+        self.first = True
+        return self
+
+    def write(self, record):
+        if not self.first:
+            self.file.write(", ")
+        self.first = False
+        self.file.write(json.dumps(record))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.write("]")
+        super().__exit__(exc_type, exc_value, traceback)
+
+class CsvMetadataWriter:
+    def __init__(self, output_file, columns):
+        self.output_file = output_file
+        self.columns = columns
+        self.file = None
+        self.writer = None
+
+    def __enter__(self):
+        self.file = open(self.output_file, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+        self.writer.writeheader()
+        return self
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet output requires the optional 'pyarrow' package")
+    return pyarrow, pyarrow.parquet
+
+class ParquetMetadataWriter:
+    # Columnar output needs the optional pyarrow package, records are flushed in row groups
+    def __init__(self, output_file, columns):
+        self.pa, self.pq = import_pyarrow()
+        self.output_file = output_file
+        self.columns = columns
+        self.batch = []
+        self.writer = None
+
+    def __enter__(self):
+        types = {"path": self.pa.string(), "format": self.pa.string(), "mode": self.pa.string(), "modified_time": self.pa.float64(), "created_time": self.pa.float64()}
+        self.schema = self.pa.schema([(column, types.get(column, self.pa.int64() if column in ("size", "width", "height", "pages") else self.pa.string())) for column in self.columns])
+        self.writer = self.pq.ParquetWriter(self.output_file, self.schema)
+        return self
+
+    def write(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= PARQUET_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            columns = {column: [record.get(column) for record in self.batch] for column in self.columns}
+            self.writer.write_table(self.pa.table(columns, schema=self.schema))
+            self.batch = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._flush()
+        finally:
+            self.writer.close()
@@ -0,0 +1,192 @@
+import os
+import io
+import json
+import logging
+from functools import partial
+from PIL import Image
+from file_utils import get_metadata, iter_files, write_file_atomic, load_json_or_yaml
+from executor import FileResult, run_parallel, summarize_results
+from manifest import Manifest, hash_params, get_file_signature
+from journal import Journal, run_journaled
+from encoding import ENCODER_PRESETS, save_image
+from action_registry import register_image_plugins
+from metrics import timer, count
+from actions.watermark import compose_image_watermark, get_watermark_text, refresh_watermark_cache
+from config import (
+    DEFAULT_WATERMARK_SIZE,
+    DEFAULT_WATERMARK_TRANSPARENCY,
+    DEFAULT_WATERMARK_POSITION,
+    DEFAULT_FONT_SIZE,
+    DEFAULT_SOFT_EDGE,
+    DEFAULT_SOFT_EDGE_WIDTH,
+    DEFAULT_SOFT_EDGE_FALLOFF,
+    DEFAULT_INCLUDE_DATE,
+    DEFAULT_WORKERS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_INCREMENTAL,
+    DEFAULT_RESUME,
+    DEFAULT_RETRY_FAILED,
+    DEFAULT_ENCODER_PRESET,
+    DEFAULT_KEEP_METADATA,
+    DEFAULT_PROFILE_DRAFT,
+    DEFAULT_PROFILE_NAMING,
+    IMAGE_EXTENSIONS
+)
+
+register_image_plugins(IMAGE_EXTENSIONS)
+
+# Output formats a profile may ask for, with the extension used in the output name
+PROFILE_FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp", "avif": ".avif"}
+
+PROFILE_DEFAULTS = {
+    "max_size": None,
+    "watermark": "",
+    "text": None,
+    "include_date": DEFAULT_INCLUDE_DATE,
+    "image_position": DEFAULT_WATERMARK_POSITION,
+    "text_position": DEFAULT_WATERMARK_POSITION,
+    "size": DEFAULT_WATERMARK_SIZE,
+    "transparency": DEFAULT_WATERMARK_TRANSPARENCY,
+    "soft_edge": DEFAULT_SOFT_EDGE,
+    "soft_edge_width": DEFAULT_SOFT_EDGE_WIDTH,
+    "soft_edge_falloff": DEFAULT_SOFT_EDGE_FALLOFF,
+    "font_size": DEFAULT_FONT_SIZE,
+    "font": "",
+    "format": None,
+    "quality": None,
+    "preset": DEFAULT_ENCODER_PRESET,
+    "keep_metadata": DEFAULT_KEEP_METADATA,
+    "naming": DEFAULT_PROFILE_NAMING
+}
+
+def apply_watermark_profiles(directory, profiles_file, include_subdirectories=True, draft=DEFAULT_PROFILE_DRAFT, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, incremental=DEFAULT_INCREMENTAL, resume=DEFAULT_RESUME, retry_failed=DEFAULT_RETRY_FAILED):
+    try:
+        profiles = load_profiles(profiles_file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error loading watermark profiles from {profiles_file}: {str(e)}")
+        return False, True
+
+    entries = iter_files(directory, include_subdirectories, extensions=IMAGE_EXTENSIONS, skip_generated=True)
+    files_to_process = [entry.path for entry in entries]
+    if not files_to_process:
+        logging.error(f"No files found to process in directory: {directory}")
+        return False, False
+
+    params_hash = hash_params("apply_watermark_profiles", {
+        "profiles": profiles,
+        "watermark_files": [get_file_signature(profile["watermark"].strip()) if profile["watermark"] else None for profile in profiles],
+        "text": [get_watermark_text(profile["text"], profile["include_date"]) for profile in profiles],
+        "draft": draft
+    })
+    manifest = Manifest(directory) if incremental else None
+    journal = Journal(directory, "apply_watermark_profiles", params_hash)
+    run = partial(run_profiles, profiles_file=profiles_file, draft=draft, workers=workers, chunk_size=chunk_size, profiles=profiles)
+    # A source is only skipped while every profile's output is still there
+    results = run_journaled(run, files_to_process, journal, manifest, incremental, lambda path: [get_profile_output_path(path, profile) for profile in profiles], resume, retry_failed)
+    if not results:
+        return True, False
+    return summarize_results(results, "apply_watermark_profiles")
+
+def run_profiles(files, profiles_file, draft=DEFAULT_PROFILE_DRAFT, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, profiles=None, on_result=None):
+    profiles = profiles or load_profiles(profiles_file)
+    refresh_watermark_cache([profile["watermark"] for profile in profiles])
+    task = partial(apply_profiles_to_file, profiles=profiles, draft=draft)
+    return run_parallel(task, files, workers, chunk_size, on_result=on_result)
+
+def load_profiles(profiles_file):
+    # A JSON/YAML list of output specs, or {"profiles": [...]}; unset keys fall back to PROFILE_DEFAULTS
+    data = load_json_or_yaml(profiles_file, "profile")
+    if isinstance(data, dict):
+        data = data.get("profiles", [])
+    if not data:
+        raise ValueError("No profiles defined")
+
+    profiles = []
+    for index, spec in enumerate(data):
+        unknown = set(spec) - set(PROFILE_DEFAULTS) - {"name"}
+        if unknown:
+            raise ValueError(f"Unknown profile settings: {', '.join(sorted(unknown))}")
+        profile = {**PROFILE_DEFAULTS, **spec}
+        profile["name"] = str(spec.get("name") or f"profile{index + 1}")
+        if profile["format"] is not None:
+            profile["format"] = profile["format"].lower().replace("jpg", "jpeg")
+            if profile["format"] not in PROFILE_FORMATS:
+                raise ValueError(f"Unsupported profile format: {profile['format']}")
+        if profile["preset"] not in ENCODER_PRESETS:
+            raise ValueError(f"Unknown encoder preset: {profile['preset']}")
+        profile["max_size"] = parse_max_size(profile["max_size"])
+        profiles.append(profile)
+
+    names = [profile["name"] for profile in profiles]
+    if len(set(names)) != len(names):
+        raise ValueError("Profile names must be unique")
+    return profiles
+
+def parse_max_size(max_size):
+    # 800 or "800" is a square box, "800x600" or [800, 600] is width by height
+    if max_size is None:
+        return None
+    values = max_size.lower().split("x") if isinstance(max_size, str) else max_size
+    if not isinstance(values, (list, tuple)):
+        values = [values, values]
+    elif len(values) == 1:
+        values = values * 2
+    try:
+        size = [int(value) for value in values]
+    except (TypeError, ValueError):
+        size = []
+    if len(size) != 2 or min(size) < 1 or isinstance(max_size, bool):
+        raise ValueError(f"max_size must be a number or WIDTHxHEIGHT, got {max_size!r}")
+    return size
+
+def get_profile_output_path(input_file, profile):
+    stem, extension = os.path.splitext(os.path.basename(input_file))
+    if profile["format"]:
+        extension = PROFILE_FORMATS[profile["format"]]
+    name = profile["naming"].format(name=profile["name"], stem=stem, ext=extension)
+    return os.path.join(os.path.dirname(input_file), name)
+
+def get_fitted_size(size, max_size):
+    # Fit inside max_size keeping the aspect ratio, never upscale
+    if not max_size:
+        return size
+    scale = min(max_size[0] / size[0], max_size[1] / size[1], 1.0)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+def apply_profiles_to_file(input_image, profiles, draft=DEFAULT_PROFILE_DRAFT):
+    try:
+        with Image.open(input_image) as source:
+            targets = [get_fitted_size(source.size, profile["max_size"]) for profile in profiles]
+            # When every output is downscaled, JPEG can decode straight to a reduced size that still covers them all
+            if draft and all(target != source.size for target in targets):
+                source.draft(source.mode, (max(width for width, _ in targets), max(height for _, height in targets)))
+            with timer("decode"):
+                source.load()
+
+            # The source is decoded once and every output is derived from it
+            for profile, target in zip(profiles, targets):
+                output_image = get_profile_output_path(input_image, profile)
+                if source.size != target:
+                    with timer("resize"):
+                        image = source.resize(target, Image.LANCZOS, reducing_gap=3.0)
+                else:
+                    # Compositing pastes into the image, so the shared source must stay untouched
+                    image = source.copy()
+                image = compose_image_watermark(image, output_image, profile["watermark"], profile["text"], profile["include_date"], profile["image_position"], profile["text_position"], profile["size"], profile["transparency"], profile["soft_edge"], profile["font_size"], profile["font"], profile["soft_edge_width"], profile["soft_edge_falloff"])
+                save_profile_output(image, output_image, profile, source.info)
+                count("apply_watermark_profiles", "outputs")
+                logging.info(f"Profile {profile['name']} applied to image file: {input_image}, saved as {output_image}")
+        count("apply_watermark_profiles", "bytes", os.path.getsize(input_image))
+    except Exception as e:
+        metadata = get_metadata(input_image)
+        logging.error(f"Error applying watermark profiles to {input_image}: {str(e)}, Metadata: {json.dumps(metadata)}")
+        raise
+    return FileResult(input_image, True)
+
+def save_profile_output(image, output_image, profile, info=None):
+    image_format = profile["format"] or Image.EXTENSION[os.path.splitext(output_image)[1].lower()].lower()
+    with timer("encode"):
+        output = io.BytesIO()
+        save_image(image, output, image_format, profile["preset"], info, profile["keep_metadata"], {"quality": profile["quality"]})
+    with timer("write"):
+        write_file_atomic(output_image, output.getvalue())
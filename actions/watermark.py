@@ -1,8 +1,20 @@
 import os
+import io
 import logging
 import json
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
-from file_utils import get_metadata, get_files_to_process
+import zlib
+import threading
+from functools import lru_cache, partial
+from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageChops
+from file_utils import get_metadata, iter_files, get_temp_path, write_file_atomic
+from executor import FileResult, run_parallel, summarize_results, resolve_workers
+from pipeline import run_pipeline
+from metrics import METRICS, timer, count
+from manifest import Manifest, hash_params, get_file_signature
+from journal import Journal, run_journaled
+from encoding import save_image
+from dedup import run_deduplicated
+from action_registry import register_image_plugins
 from datetime import datetime
 from config import (
     DEFAULT_WATERMARK_SIZE,
@@ -10,105 +22,457 @@ from config import (
     DEFAULT_FONT_SIZE,
     DEFAULT_SOFT_EDGE,
     DEFAULT_INCLUDE_DATE,
-    DEFAULT_WATERMARK_POSITION
+    DEFAULT_WATERMARK_POSITION,
+    DEFAULT_SOFT_EDGE_WIDTH,
+    DEFAULT_SOFT_EDGE_FALLOFF,
+    DEFAULT_WORKERS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_INCREMENTAL,
+    DEFAULT_PIPELINE,
+    DEFAULT_PIPELINE_IN_FLIGHT,
+    DEFAULT_REGION_COMPOSITING,
+    DEFAULT_RESUME,
+    DEFAULT_RETRY_FAILED,
+    DEFAULT_ENCODER_PRESET,
+    DEFAULT_KEEP_METADATA,
+    DEFAULT_DEDUP,
+    WATERMARK_CACHE_SIZE,
+    WATERMARK_SOURCE_CACHE_SIZE,
+    FONT_CACHE_SIZE,
+    PDF_STAMP_DPI,
+    IMAGE_EXTENSIONS,
+    PDF_EXTENSIONS
 )
 
-def apply_watermark_to_files(directory, watermark, text=None, include_date=DEFAULT_INCLUDE_DATE, image_position=DEFAULT_WATERMARK_POSITION, text_position=DEFAULT_WATERMARK_POSITION, size=DEFAULT_WATERMARK_SIZE, transparency=DEFAULT_WATERMARK_TRANSPARENCY, soft_edge=DEFAULT_SOFT_EDGE, font_size=DEFAULT_FONT_SIZE, font="", include_subdirectories=True):
-    files_to_process = get_files_to_process(directory, include_subdirectories)
-    if not files_to_process:
+register_image_plugins(IMAGE_EXTENSIONS)
+
+# Modes that survive a round trip through RGBA unchanged, so only the stamped region has to be converted
+REGION_COMPOSITING_MODES = ("RGB", "RGBA")
+
+def apply_watermark_to_files(directory, watermark="", text=None, include_date=DEFAULT_INCLUDE_DATE, image_position=DEFAULT_WATERMARK_POSITION, text_position=DEFAULT_WATERMARK_POSITION, size=DEFAULT_WATERMARK_SIZE, transparency=DEFAULT_WATERMARK_TRANSPARENCY, soft_edge=DEFAULT_SOFT_EDGE, font_size=DEFAULT_FONT_SIZE, font="", include_subdirectories=True, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, incremental=DEFAULT_INCREMENTAL, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, resume=DEFAULT_RESUME, retry_failed=DEFAULT_RETRY_FAILED, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA, dedup=DEFAULT_DEDUP):
+    entries = iter_files(directory, include_subdirectories, extensions=IMAGE_EXTENSIONS + PDF_EXTENSIONS, skip_generated=True)
+    params_hash = hash_params("apply_watermark", {
+        "watermark": watermark,
+        "watermark_file": get_file_signature(watermark.strip()) if watermark else None,
+        "text": text,
+        "date": datetime.now().strftime("%Y-%m-%d") if include_date else None,
+        "image_position": image_position,
+        "text_position": text_position,
+        "size": size,
+        "transparency": transparency,
+        "soft_edge": soft_edge,
+        "soft_edge_width": soft_edge_width,
+        "soft_edge_falloff": soft_edge_falloff,
+        "font_size": font_size,
+        "font": font,
+        "encoder_preset": encoder_preset,
+        "keep_metadata": keep_metadata
+    })
+    run = partial(run_watermark, watermark=watermark, text=text, include_date=include_date, image_position=image_position, text_position=text_position, size=size, transparency=transparency, soft_edge=soft_edge, font_size=font_size, font=font, soft_edge_width=soft_edge_width, soft_edge_falloff=soft_edge_falloff, workers=workers, chunk_size=chunk_size, pipeline=pipeline, in_flight=in_flight, encoder_preset=encoder_preset, keep_metadata=keep_metadata)
+    if dedup:
+        # Identical inputs are watermarked once, the other copies get a link to that output
+        run_files = lambda files, on_result: run_deduplicated(run, files, get_watermark_output_path, manifest, on_result)
+    else:
+        run_files = run
+    paths = (entry.path for entry in entries)
+    # The manifest also caches the content hashes used for dedup. Without it, files are handed to the
+    # workers while discovery is still running.
+    manifest = Manifest(directory) if incremental or dedup else None
+    if manifest is not None:
+        paths = list(paths)
+        if not paths:
+            logging.error(f"No files found to process in directory: {directory}")
+            return False, False
+    journal = Journal(directory, "apply_watermark", params_hash)
+    results = run_journaled(run_files, paths, journal, manifest, incremental, lambda path: [get_watermark_output_path(path)], resume, retry_failed)
+    if not results:
+        if manifest is not None or ((resume or retry_failed) and journal.outcomes):
+            logging.info(f"Nothing left to watermark in directory: {directory}")
+            return True, False
         logging.error(f"No files found to process in directory: {directory}")
         return False, False
+    logging.debug(f"Watermark cache stats: {json.dumps(get_watermark_cache_stats())}")
+    return summarize_results(results, "apply_watermark")
 
-    return apply_watermark(files_to_process, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font)
+def apply_watermark(files, watermark="", text=None, include_date=False, image_position="bottom_center", text_position="bottom_center", size=10, transparency=128, soft_edge=True, font_size=20, font="", soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA):
+    results = run_watermark(files, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff, workers, chunk_size, pipeline, in_flight, encoder_preset, keep_metadata)
+    logging.debug(f"Watermark cache stats: {json.dumps(get_watermark_cache_stats())}")
+    return summarize_results(results, "apply_watermark")
 
-def apply_watermark(files, watermark, text=None, include_date=False, image_position="bottom_center", text_position="bottom_center", size=10, transparency=128, soft_edge=True, font_size=20, font=""):
-    success = True
-    partial_success = False
-    for file in files:
-        try:
-            if file.endswith('.pdf'):
-                apply_pdf_watermark(file, watermark, text, include_date, image_position, text_position, size, font_size, font)
-            elif file.endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                apply_image_watermark(file, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font)
-            else:
-                logging.info(f"Skipping unsupported file type: {file}")
-        except Exception as e:
-            partial_success = True
-            metadata = get_metadata(file)
-            logging.error(f"Error applying watermark to {file}: {str(e)}, Metadata: {json.dumps(metadata)}")
-            success = False
-    return success, partial_success
-
-def apply_image_watermark(input_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font):
-    output_image = os.path.join(os.path.dirname(input_image), f"watermarked_{os.path.basename(input_image)}")
+def run_watermark(files, watermark="", text=None, include_date=False, image_position="bottom_center", text_position="bottom_center", size=10, transparency=128, soft_edge=True, font_size=20, font="", soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pipeline=DEFAULT_PIPELINE, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA, on_result=None):
+    params = dict(watermark=watermark, text=text, include_date=include_date, image_position=image_position, text_position=text_position, size=size, transparency=transparency, soft_edge=soft_edge, font_size=font_size, font=font, soft_edge_width=soft_edge_width, soft_edge_falloff=soft_edge_falloff, encoder_preset=encoder_preset, keep_metadata=keep_metadata)
+    initargs = (watermark, bool(text or include_date), font, font_size)
+    refresh_watermark_cache([watermark])
+    if pipeline:
+        # Reading and writing happen on I/O threads while the previous files are being composited
+        compute = partial(watermark_file_data, **params)
+        return run_pipeline(files, read_watermark_input, compute, write_watermark_output, workers, in_flight, use_processes=resolve_workers(workers) > 1, initializer=init_watermark_worker, initargs=initargs, on_result=on_result)
+    task = partial(watermark_file, **params)
+    return run_parallel(task, files, workers, chunk_size, initializer=init_watermark_worker, initargs=initargs, on_result=on_result)
+
+def init_watermark_worker(watermark, use_font, font, font_size):
+    # Decode the watermark and load the font once per worker instead of once per file
+    reset_cache_baseline()
     try:
-        base_image = Image.open(input_image).convert("RGBA")
+        if watermark:
+            load_watermark(watermark.strip())
+        if use_font:
+            get_font(font, font_size)
+    except Exception as e:
+        logging.debug(f"Could not preload watermark resources: {str(e)}")
 
-        # Create a transparent layer the size of the base image
-        txt = Image.new('RGBA', base_image.size, (255, 255, 255, 0))
+def watermark_file(file, watermark, text=None, include_date=False, image_position="bottom_center", text_position="bottom_center", size=10, transparency=128, soft_edge=True, font_size=20, font="", soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA):
+    try:
+        if file.lower().endswith(PDF_EXTENSIONS):
+            apply_pdf_watermark(file, watermark, text, include_date, image_position, text_position, size, font_size, font, transparency, soft_edge, soft_edge_width, soft_edge_falloff)
+        elif file.lower().endswith(IMAGE_EXTENSIONS):
+            apply_image_watermark(file, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff, encoder_preset=encoder_preset, keep_metadata=keep_metadata)
+        else:
+            logging.info(f"Skipping unsupported file type: {file}")
+            return FileResult(file, True, skipped=True)
+    except Exception as e:
+        metadata = get_metadata(file)
+        logging.error(f"Error applying watermark to {file}: {str(e)}, Metadata: {json.dumps(metadata)}")
+        raise
+    finally:
+        count_cache_stats()
+    return FileResult(file, True)
+
+def read_watermark_input(file):
+    # PDFs are streamed page by page by their own writer, so only images are read up front
+    if file.lower().endswith(IMAGE_EXTENSIONS):
+        with timer("read"), open(file, 'rb') as f:
+            return f.read()
+    return None
+
+def watermark_file_data(file, data, watermark, text=None, include_date=False, image_position="bottom_center", text_position="bottom_center", size=10, transparency=128, soft_edge=True, font_size=20, font="", soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA):
+    # Pipeline compute stage: returns the encoded output image, or the finished FileResult for other files
+    if data is None:
+        return watermark_file(file, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff, encoder_preset, keep_metadata)
+    try:
+        with Image.open(io.BytesIO(data)) as base_image:
+            with timer("decode"):
+                base_image.load()
+            info = base_image.info
+            watermarked_image = compose_image_watermark(base_image, file, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff)
+        encoded = encode_image(watermarked_image, file, encoder_preset, info, keep_metadata)
+        count("apply_watermark", "bytes", len(data))
+        return encoded
+    except Exception as e:
+        metadata = get_metadata(file)
+        logging.error(f"Error applying image watermark to {file}: {str(e)}, Metadata: {json.dumps(metadata)}")
+        raise
+    finally:
+        count_cache_stats()
+
+def write_watermark_output(file, result):
+    if isinstance(result, FileResult):
+        return result
+    output_image = get_watermark_output_path(file)
+    with timer("write"):
+        write_file_atomic(output_image, result)
+    logging.info(f"Watermark applied to image file: {file}, saved as {output_image}")
+    return FileResult(file, True)
 
+def encode_image(image, file, encoder_preset=DEFAULT_ENCODER_PRESET, info=None, keep_metadata=DEFAULT_KEEP_METADATA):
+    # info is the source's Image.info, compositing may return a new image without it
+    with timer("encode"):
+        output = io.BytesIO()
+        save_image(image, output, get_image_format(file), encoder_preset, info, keep_metadata)
+        return output.getvalue()
+
+def get_image_format(file):
+    # Same format Image.save() would pick from the output extension
+    return Image.EXTENSION[os.path.splitext(file)[1].lower()]
+
+def get_watermark_output_path(input_file):
+    return os.path.join(os.path.dirname(input_file), f"watermarked_{os.path.basename(input_file)}")
+
+def apply_image_watermark(input_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, region_compositing=DEFAULT_REGION_COMPOSITING, encoder_preset=DEFAULT_ENCODER_PRESET, keep_metadata=DEFAULT_KEEP_METADATA):
+    output_image = get_watermark_output_path(input_image)
+    try:
+        with Image.open(input_image) as base_image:
+            with timer("decode"):
+                base_image.load()
+            info = base_image.info
+            watermarked_image = compose_image_watermark(base_image, input_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff, region_compositing)
+        # Encoding into memory first keeps encode and disk write measurable as separate stages
+        encoded = encode_image(watermarked_image, input_image, encoder_preset, info, keep_metadata)
+        with timer("write"):
+            write_file_atomic(output_image, encoded)
+        count("apply_watermark", "bytes", os.path.getsize(input_image))
+        logging.info(f"Watermark applied to image file: {input_image}, saved as {output_image}")
+    except Exception as e:
+        metadata = get_metadata(input_image)
+        logging.error(f"Error applying image watermark to {input_image}: {str(e)}, Metadata: {json.dumps(metadata)}")
+        raise
+
+def compose_image_watermark(base_image, input_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF, region_compositing=DEFAULT_REGION_COMPOSITING):
+    if region_compositing and base_image.mode in REGION_COMPOSITING_MODES:
+        return compose_watermark_region(base_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff)
+
+    # Other modes (palette, grayscale, CMYK, ...) are composited over the full frame
+    watermark_image = None
+    text_content = None
+    with timer("watermark_prep"):
         if watermark:
             watermark = watermark.strip()  # Trim any leading or trailing spaces
-            watermark_image = Image.open(watermark).convert("RGBA")
-
-            # Scale the watermark to fit the base image if necessary
-            watermark_size = (base_image.width * size // 100, base_image.height * size // 100)
-            watermark_image.thumbnail(watermark_size)
+            watermark_image = get_prepared_watermark(watermark, base_image.size, size, transparency, soft_edge, soft_edge_width, soft_edge_falloff)
+        if text or include_date:
+            font = get_font(font, font_size)
+            text_content = get_watermark_text(text, include_date)
 
-            # Apply transparency to the watermark
-            watermark_image = adjust_transparency(watermark_image, transparency)
+    with timer("composite"):
+        base_image = base_image.convert("RGBA")
 
-            # Apply soft edges to the watermark
-            if soft_edge:
-                watermark_image = apply_soft_edges(watermark_image)
+        # Create a transparent layer the size of the base image
+        txt = Image.new('RGBA', base_image.size, (255, 255, 255, 0))
 
+        if watermark_image is not None:
             watermark_position = get_watermark_position(base_image.size, watermark_image.size, image_position)
             txt.paste(watermark_image, watermark_position, watermark_image)
 
-        if text or include_date:
+        if text_content is not None:
             draw = ImageDraw.Draw(txt)
-            if font:
-                font = ImageFont.truetype(font, font_size)
-            else:
-                font = ImageFont.truetype("arial.ttf", font_size)  # Use a default truetype font
             text_position = get_text_position(base_image.size, text_position)
-            text_content = text if text else ""
-            if include_date:
-                date_str = datetime.now().strftime("%Y-%m-%d")
-                text_content += f" {date_str}"
             draw.text(text_position, text_content, font=font, fill=(255, 255, 255, 128))  # White text with transparency
 
         # Combine the base image with the text/watermark layer
         watermarked_image = Image.alpha_composite(base_image, txt)
-        
+
         if input_image.lower().endswith('.jpg') or input_image.lower().endswith('.jpeg'):
             watermarked_image = watermarked_image.convert("RGB")
-        
-        watermarked_image.save(output_image)
-        logging.info(f"Watermark applied to image file: {input_image}, saved as {output_image}")
+    return watermarked_image
+
+def compose_watermark_region(base_image, watermark, text, include_date, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF):
+    # Only the bounding box of the stamp is converted to RGBA and blended, then pasted back in the original mode
+    watermark_image = None
+    text_content = None
+    box = None
+    with timer("watermark_prep"):
+        if watermark:
+            watermark = watermark.strip()  # Trim any leading or trailing spaces
+            watermark_image = get_prepared_watermark(watermark, base_image.size, size, transparency, soft_edge, soft_edge_width, soft_edge_falloff)
+            watermark_position = get_watermark_position(base_image.size, watermark_image.size, image_position)
+            box = union_box(box, (watermark_position[0], watermark_position[1], watermark_position[0] + watermark_image.width, watermark_position[1] + watermark_image.height))
+
+        if text or include_date:
+            font = get_font(font, font_size)
+            text_position = get_text_position(base_image.size, text_position)
+            text_content = get_watermark_text(text, include_date)
+            left, top, right, bottom = font.getbbox(text_content)
+            box = union_box(box, (text_position[0] + left, text_position[1] + top, text_position[0] + right, text_position[1] + bottom))
+
+    if box is None:
+        return base_image
+    box = (max(0, box[0]), max(0, box[1]), min(base_image.width, box[2]), min(base_image.height, box[3]))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return base_image
+
+    with timer("composite"):
+        region = base_image.crop(box).convert("RGBA")
+        layer = Image.new('RGBA', region.size, (255, 255, 255, 0))
+        if watermark_image is not None:
+            layer.paste(watermark_image, (watermark_position[0] - box[0], watermark_position[1] - box[1]), watermark_image)
+        if text_content is not None:
+            draw = ImageDraw.Draw(layer)
+            draw.text((text_position[0] - box[0], text_position[1] - box[1]), text_content, font=font, fill=(255, 255, 255, 128))  # White text with transparency
+
+        region = Image.alpha_composite(region, layer)
+        base_image.paste(region.convert(base_image.mode), box[:2])
+    return base_image
+
+def union_box(box, other):
+    if box is None:
+        return other
+    return (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+
+def get_watermark_text(text, include_date):
+    text_content = text if text else ""
+    if include_date:
+        date_str = datetime.now().strftime("%Y-%m-%d")
+        text_content += f" {date_str}"
+    return text_content
+
+def apply_pdf_watermark(input_pdf, watermark, text, include_date, image_position, text_position, size, font_size, font, transparency=DEFAULT_WATERMARK_TRANSPARENCY, soft_edge=DEFAULT_SOFT_EDGE, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF):
+    # PyPDF2 is slow to import, so it is only loaded once a PDF is actually watermarked
+    from pdf_utils import StreamingPdfWriter, open_pdf, add_stamp_overlay, stamp_page, detach_resources
+    output_pdf = get_watermark_output_path(input_pdf)
+    watermark = watermark.strip() if watermark else ""
+    text_content = get_watermark_text(text, include_date) if (text or include_date) else ""
+    try:
+        handle, reader = open_pdf(input_pdf)
+        writer = None
+        try:
+            # Written under a temporary name and renamed once complete, like image outputs
+            writer = StreamingPdfWriter(get_temp_path(output_pdf), dedup_resources=False)
+            # One overlay per distinct page box, shared by every page of that size
+            overlays = {}
+            for page_index in range(len(reader.pages)):
+                # Shared resource dictionaries are flushed with the first page that uses them
+                page = writer.add_page(detach_resources(reader.pages[page_index]))
+                box = page.mediabox
+                key = (round(float(box.left), 2), round(float(box.bottom), 2), round(float(box.width), 2), round(float(box.height), 2))
+                if key not in overlays:
+                    with timer("watermark_prep"):
+                        stamp = get_pdf_stamp(key[2:], watermark, text_content, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width, soft_edge_falloff)
+                    overlays[key] = add_stamp_overlay(writer, key, stamp)
+                stamp_page(page, overlays[key])
+                with timer("write"):
+                    writer.flush()
+            writer.close()
+            os.replace(writer.path, output_pdf)
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            handle.close()
+        count("apply_watermark", "bytes", os.path.getsize(input_pdf))
+        count("apply_watermark", "pages", len(reader.pages))
+        logging.info(f"Watermark applied to PDF file: {input_pdf}, saved as {output_pdf}")
     except Exception as e:
-        metadata = get_metadata(input_image)
-        logging.error(f"Error applying image watermark to {input_image}: {str(e)}, Metadata: {json.dumps(metadata)}")
+        metadata = get_metadata(input_pdf)
+        logging.error(f"Error applying PDF watermark to {input_pdf}: {str(e)}, Metadata: {json.dumps(metadata)}")
         raise
 
+# Stamps are rasterised once per page size at PDF_STAMP_DPI and reused for every page and file of that size
+@lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def get_pdf_stamp(page_size, watermark, text_content, image_position, text_position, size, transparency, soft_edge, font_size, font, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF):
+    scale = PDF_STAMP_DPI / 72
+    base_size = (max(1, round(page_size[0] * scale)), max(1, round(page_size[1] * scale)))
+    images = []
+    if watermark:
+        watermark_image = get_prepared_watermark(watermark, base_size, size, transparency, soft_edge, soft_edge_width, soft_edge_falloff)
+        position = get_watermark_position(base_size, watermark_image.size, image_position)
+        images.append(encode_pdf_stamp_image(watermark_image, position, page_size[1], scale))
+    if text_content:
+        stamp_font = get_font(font, max(1, round(font_size * scale)))
+        left, top, right, bottom = stamp_font.getbbox(text_content)
+        text_image = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (255, 255, 255, 0))
+        ImageDraw.Draw(text_image).text((-left, -top), text_content, font=stamp_font, fill=(255, 255, 255, 128))  # White text with transparency
+        position = get_text_position(base_size, text_position)
+        images.append(encode_pdf_stamp_image(text_image, (position[0] + left, position[1] + top), page_size[1], scale))
+    return tuple(images)
+
+def encode_pdf_stamp_image(image, position, page_height, scale):
+    # Converts a top-left pixel position into PDF points measured from the bottom-left corner
+    width = image.width / scale
+    height = image.height / scale
+    x = position[0] / scale
+    y = page_height - position[1] / scale - height
+    rgb_data = zlib.compress(image.convert('RGB').tobytes())
+    alpha_data = zlib.compress(image.getchannel('A').tobytes())
+    return (image.width, image.height, rgb_data, alpha_data, (x, y, width, height))
+
+@lru_cache(maxsize=WATERMARK_SOURCE_CACHE_SIZE)
+def load_watermark(watermark):
+    with Image.open(watermark) as source:
+        return source.convert("RGBA")
+
+# The prepared stamp only depends on these inputs, so batches of same-sized images reuse it
+@lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def get_prepared_watermark(watermark, base_size, size, transparency, soft_edge, soft_edge_width=DEFAULT_SOFT_EDGE_WIDTH, soft_edge_falloff=DEFAULT_SOFT_EDGE_FALLOFF):
+    watermark_image = load_watermark(watermark).copy()
+
+    # Scale the watermark to fit the base image if necessary
+    watermark_size = (base_size[0] * size // 100, base_size[1] * size // 100)
+    watermark_image.thumbnail(watermark_size)
+
+    # Apply transparency to the watermark
+    watermark_image = adjust_transparency(watermark_image, transparency)
+
+    # Apply soft edges to the watermark
+    if soft_edge:
+        watermark_image = apply_soft_edges(watermark_image, soft_edge_width, soft_edge_falloff)
+    return watermark_image
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font, font_size):
+    # Fall back to a default truetype font
+    return ImageFont.truetype(font or "arial.ttf", font_size)
+
+WATERMARK_CACHES = {"source": load_watermark, "watermark": get_prepared_watermark, "pdf_stamp": get_pdf_stamp, "font": get_font}
+reported_cache_stats = {}
+cache_stats_lock = threading.Lock()
+
+def reset_cache_baseline():
+    # Forked workers inherit the parent's cache statistics, only their own lookups are counted
+    with cache_stats_lock:
+        for name, cached in WATERMARK_CACHES.items():
+            info = cached.cache_info()
+            reported_cache_stats[name] = (info.hits, info.misses)
+
+def count_cache_stats():
+    # The caches live in whichever process did the work, so hits and misses travel back as METRICS counters
+    with cache_stats_lock:
+        for name, cached in WATERMARK_CACHES.items():
+            info = cached.cache_info()
+            hits, misses = reported_cache_stats.get(name, (0, 0))
+            if info.hits != hits or info.misses != misses:
+                count("watermark_cache", f"{name}_hits", info.hits - hits)
+                count("watermark_cache", f"{name}_misses", info.misses - misses)
+                reported_cache_stats[name] = (info.hits, info.misses)
+
+def get_watermark_cache_stats():
+    # Hits and misses of every worker, merged like the other METRICS
+    count_cache_stats()
+    return METRICS.snapshot()["counters"].get("watermark_cache", {})
+
+def clear_watermark_cache():
+    # Report what the caches did so far, their hit and miss counts restart at zero
+    count_cache_stats()
+    for cached in WATERMARK_CACHES.values():
+        cached.cache_clear()
+    reset_cache_baseline()
+
+# Size and mtime of every watermark file used in this process
+watermark_signatures = {}
+
+def refresh_watermark_cache(watermarks):
+    # The caches are keyed by path, so a watermark file edited between runs of a long-lived process
+    # (job files, queue workers, the interactive loop) would keep its stale decode. Called before
+    # workers are started, so forked workers never inherit it either.
+    signatures = {watermark.strip(): get_file_signature(watermark.strip()) for watermark in watermarks if watermark}
+    changed = any(path in watermark_signatures and watermark_signatures[path] != signature for path, signature in signatures.items())
+    watermark_signatures.update(signatures)
+    if changed:
+        clear_watermark_cache()
+
 def adjust_transparency(image, transparency):
     alpha = image.split()[3]
     alpha = ImageEnhance.Brightness(alpha).enhance(transparency / 255.0)
     image.putalpha(alpha)
     return image
 
-def apply_soft_edges(image):
+SOFT_EDGE_FALLOFFS = {
+    "linear": lambda t: t,
+    "ease_in": lambda t: t * t,
+    "ease_out": lambda t: 1 - (1 - t) * (1 - t),
+    "smooth": lambda t: t * t * (3 - 2 * t)
+}
+
+def get_soft_edge_value(distance, feather, falloff):
+    if feather <= 0:
+        return 255
+    if falloff == "linear":
+        # Integer math keeps the default feather identical to the old distance * 5 mask
+        return max(0, min(255, distance * 255 // feather))
+    curve = SOFT_EDGE_FALLOFFS.get(falloff)
+    if curve is None:
+        raise ValueError(f"Unknown soft edge falloff: {falloff}")
+    return max(0, min(255, round(curve(min(1.0, distance / feather)) * 255)))
+
+def apply_soft_edges(image, feather=DEFAULT_SOFT_EDGE_WIDTH, falloff=DEFAULT_SOFT_EDGE_FALLOFF):
     width, height = image.size
-    alpha = image.split()[3]
 
-    new_alpha = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(new_alpha)
-    for i in range(width):
-        for j in range(height):
-            distance = min(i, j, width - i, height - j)
-            new_alpha.putpixel((i, j), max(0, min(255, distance * 5)))
+    # The mask is min(column ramp, row ramp), so build both 1-D ramps and let Pillow broadcast them
+    columns = Image.new('L', (width, 1))
+    columns.putdata([get_soft_edge_value(min(i, width - i), feather, falloff) for i in range(width)])
+    rows = Image.new('L', (1, height))
+    rows.putdata([get_soft_edge_value(min(j, height - j), feather, falloff) for j in range(height)])
 
-    alpha = ImageEnhance.Brightness(new_alpha).enhance(1.0)
+    alpha = ImageChops.darker(columns.resize((width, height), Image.NEAREST), rows.resize((width, height), Image.NEAREST))
     image.putalpha(alpha)
     return image
 
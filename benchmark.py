@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows, peak RSS is reported as null there
+
+IMAGE_FORMATS = ('.jpg', '.png', '.webp')
+
+# Synthetic corpus per scale: image sizes are cycled, PDFs alternate between the page counts
+SCALES = {
+    "small": {"image_count": 12, "image_sizes": [(640, 480), (1280, 960)], "pdf_count": 4, "pdf_pages": [1, 5], "tree_files": 500, "tree_depth": 4},
+    "medium": {"image_count": 48, "image_sizes": [(1920, 1080), (4000, 3000)], "pdf_count": 12, "pdf_pages": [5, 20], "tree_files": 5000, "tree_depth": 6},
+    "large": {"image_count": 120, "image_sizes": [(4000, 3000), (8000, 6000)], "pdf_count": 24, "pdf_pages": [20, 100], "tree_files": 50000, "tree_depth": 8}
+}
+
+BENCHMARKS = ["get_files_to_process_flat", "get_files_to_process_deep", "copy_metadata", "apply_watermark", "merge_images", "merge_pdfs"]
+
+
+def generate_corpus(root, scale):
+    from PIL import Image
+    profile = SCALES[scale]
+    images_directory = os.path.join(root, "images")
+    pdfs_directory = os.path.join(root, "pdfs")
+    for directory in (images_directory, pdfs_directory, os.path.join(root, "output")):
+        os.makedirs(directory, exist_ok=True)
+
+    for index in range(profile["image_count"]):
+        size = profile["image_sizes"][index % len(profile["image_sizes"])]
+        extension = IMAGE_FORMATS[index % len(IMAGE_FORMATS)]
+        # Noise defeats compression, so encode/decode costs are close to real photos
+        Image.effect_noise(size, 64).convert("RGB").save(os.path.join(images_directory, f"image_{index:04d}{extension}"))
+
+    for index in range(profile["pdf_count"]):
+        page_count = profile["pdf_pages"][index % len(profile["pdf_pages"])]
+        pages = [Image.effect_noise((612, 792), 32).convert("RGB") for _ in range(page_count)]
+        pages[0].save(os.path.join(pdfs_directory, f"document_{index:04d}.pdf"), save_all=True, append_images=pages[1:])
+
+    watermark = Image.new("RGBA", (400, 200), (255, 255, 255, 0))
+    watermark.paste((200, 30, 30, 255), (40, 40, 360, 160))
+    watermark.save(os.path.join(root, "watermark.png"))
+
+    generate_tree(os.path.join(root, "tree_flat"), profile["tree_files"], 0)
+    generate_tree(os.path.join(root, "tree_deep"), profile["tree_files"], profile["tree_depth"])
+
+def generate_tree(root, file_count, depth):
+    # depth 0 puts every file in one directory, otherwise files are spread over a binary tree of that depth
+    directories = [root]
+    for _ in range(depth):
+        directories = [os.path.join(directory, name) for directory in directories for name in ("a", "b")]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    extensions = IMAGE_FORMATS + ('.pdf', '.txt')
+    for index in range(file_count):
+        directory = directories[index % len(directories)]
+        with open(os.path.join(directory, f"file_{index:06d}{extensions[index % len(extensions)]}"), 'wb') as f:
+            f.write(b"\0" * 64)
+
+def percentile(values, percent):
+    # Nearest-rank percentile, good enough for latency reporting
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+def list_files(directory, extensions):
+    # Outputs of earlier benchmarks (watermarked_*, metadata.json) must not become inputs
+    from file_utils import is_generated_file
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(extensions) and not is_generated_file(name))
+
+def total_bytes(files):
+    return sum(os.path.getsize(file) for file in files)
+
+def timed_task(func, path):
+    started = time.perf_counter()
+    func(path)
+    return time.perf_counter() - started
+
+def repeat_call(func, repeat):
+    latencies = []
+    failed = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        latencies.append(time.perf_counter() - started)
+        # Actions return (success, partial_success)
+        if isinstance(result, tuple) and not result[0]:
+            failed += 1
+    return latencies, failed
+
+def run_benchmark(name, root, repeat=3, workers=1, streaming=False, encoder_preset=None):
+    # Runs in a fresh process, so peak RSS belongs to this benchmark alone
+    logging.basicConfig(level=logging.CRITICAL)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from config import IMAGE_EXTENSIONS, PDF_EXTENSIONS, DEFAULT_ENCODER_PRESET
+    encoder_preset = encoder_preset or DEFAULT_ENCODER_PRESET
+    images = list_files(os.path.join(root, "images"), IMAGE_EXTENSIONS)
+    pdfs = list_files(os.path.join(root, "pdfs"), PDF_EXTENSIONS)
+    output_directory = os.path.join(root, "output")
+
+    outputs = []
+    started = time.perf_counter()
+    if name.startswith("get_files_to_process"):
+        from file_utils import get_files_to_process
+        tree = os.path.join(root, "tree_deep" if name.endswith("deep") else "tree_flat")
+        items = len(get_files_to_process(tree))
+        size = 0
+        latencies, failed = repeat_call(partial(get_files_to_process, tree), repeat)
+    elif name == "copy_metadata":
+        from actions.metadata import copy_metadata
+        items, size = len(images), total_bytes(images)
+        latencies, failed = repeat_call(partial(copy_metadata, os.path.join(root, "images"), incremental=False, include_hash=True, include_media_info=True), repeat)
+    elif name == "apply_watermark":
+        from executor import run_parallel
+        from actions.watermark import watermark_file, init_watermark_worker, get_watermark_output_path
+        files = images + pdfs
+        outputs = [get_watermark_output_path(file) for file in images]
+        items, size = len(files), total_bytes(files)
+        watermark = os.path.join(root, "watermark.png")
+        task = partial(timed_task, partial(watermark_file, watermark=watermark, size=20, encoder_preset=encoder_preset))
+        latencies = []
+        failed = 0
+        for _ in range(repeat):
+            for result in run_parallel(task, files, workers, initializer=init_watermark_worker, initargs=(watermark, False, "", 0)):
+                if result.success:
+                    latencies.append(result.value)
+                else:
+                    failed += 1
+    elif name == "merge_images":
+        from actions.merge import merge_images
+        items, size = len(images), total_bytes(images)
+        columns = math.ceil(math.sqrt(len(images)))
+        matrix = f"{math.ceil(len(images) / columns)},{columns}"
+        outputs = [os.path.join(output_directory, "merged_image.png" if streaming else "merged_image.jpg")]
+        latencies, failed = repeat_call(partial(merge_images, images, output_directory, matrix, "stretch", streaming, encoder_preset=encoder_preset), repeat)
+    elif name == "merge_pdfs":
+        from actions.merge import merge_pdfs
+        items, size = len(pdfs), total_bytes(pdfs)
+        latencies, failed = repeat_call(partial(merge_pdfs, pdfs, output_directory), repeat)
+    else:
+        raise ValueError(f"Unknown benchmark: {name}")
+    elapsed = time.perf_counter() - started
+
+    processed = items * repeat
+    return {
+        "name": name,
+        "items": items,
+        "bytes": size,
+        "repeat": repeat,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_items_s": round(processed / elapsed, 2) if elapsed else None,
+        "throughput_mb_s": round(size * repeat / elapsed / (1024 * 1024), 2) if elapsed and size else None,
+        # Encoded image output size, the other side of the encoder preset trade-off
+        "output_bytes": total_bytes([output for output in outputs if os.path.exists(output)]) if outputs else None,
+        # Per-file latency for apply_watermark, per-call latency for actions that take the whole corpus at once
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "max": round(max(latencies) * 1000, 3) if latencies else None
+        },
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+
+def run_isolated(name, root, repeat, workers, streaming, encoder_preset=None):
+    # A spawned interpreter starts with a clean heap, unlike a forked one
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_benchmark, name, root, repeat, workers, streaming, encoder_preset).result()
+
+def get_environment():
+    try:
+        import PIL
+        pillow_version = PIL.__version__
+    except ImportError:
+        pillow_version = None
+    try:
+        import PyPDF2
+        pypdf2_version = PyPDF2.__version__
+    except ImportError:
+        pypdf2_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pillow": pillow_version,
+        "pypdf2": pypdf2_version
+    }
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="File Processor benchmarks")
+    parser.add_argument('--scale', choices=list(SCALES), default="small", help='Size of the synthetic corpus')
+    parser.add_argument('--benchmarks', default=",".join(BENCHMARKS), help='Comma-separated benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark')
+    parser.add_argument('--workers', type=int, default=1, help='Workers for apply_watermark (0 uses every core)')
+    parser.add_argument('--streaming', action='store_true', help='Use the streaming PNG writer for merge_images')
+    parser.add_argument('--encoder-preset', choices=['fast', 'balanced', 'small'], help='Encoder preset for apply_watermark and merge_images outputs')
+    parser.add_argument('--corpus', help='Reuse or keep the corpus in this directory instead of a temporary one')
+    parser.add_argument('--output', help='Also write the JSON results to this file')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    root = args.corpus or tempfile.mkdtemp(prefix="file_processor_benchmark_")
+    try:
+        if not os.path.exists(os.path.join(root, "watermark.png")):
+            generate_corpus(root, args.scale)
+        results = [run_isolated(name, root, args.repeat, args.workers, args.streaming, args.encoder_preset) for name in names]
+    finally:
+        if not args.corpus:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "scale": args.scale,
+        "workers": args.workers,
+        "encoder_preset": args.encoder_preset,
+        "environment": get_environment(),
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,95 @@
 # config.py
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+PDF_EXTENSIONS = ('.pdf',)
+
 DEFAULT_WATERMARK_SIZE = 40
 DEFAULT_WATERMARK_TRANSPARENCY = 100
 DEFAULT_WATERMARK_POSITION = "bottom_center"
 DEFAULT_FONT_SIZE = 20
 DEFAULT_SOFT_EDGE = True
+DEFAULT_SOFT_EDGE_WIDTH = 51
+DEFAULT_SOFT_EDGE_FALLOFF = "linear"
 DEFAULT_INCLUDE_DATE = False
 DEFAULT_SAME_POSITION = True
+
+# Bounded LRU caches for prepared watermarks and fonts
+WATERMARK_CACHE_SIZE = 32
+WATERMARK_SOURCE_CACHE_SIZE = 4
+FONT_CACHE_SIZE = 8
+
+# Blend only the watermark's bounding box instead of converting the whole image to RGBA
+DEFAULT_REGION_COMPOSITING = True
+
+# Resolution at which image/text stamps are rasterised for PDF pages
+PDF_STAMP_DPI = 150
+
+# Parallel execution (0 workers means one per CPU core)
+DEFAULT_WORKERS = 1
+DEFAULT_CHUNK_SIZE = 16
+
+# Image merging (0 keeps tiles at full resolution)
+DEFAULT_MERGE_STREAMING = False
+DEFAULT_MAX_TILE_SIZE = 0
+
+# Incremental runs skip inputs that are unchanged since the last run
+DEFAULT_INCREMENTAL = True
+MANIFEST_FILENAME = ".file_processor_manifest.json"
+MANIFEST_SAVE_SECONDS = 5.0  # While a run is going, progress is written to the manifest at most this often
+
+# Metadata export
+DEFAULT_METADATA_FORMAT = "json"
+DEFAULT_METADATA_WORKERS = 8
+DEFAULT_HASH_ALGORITHM = "sha256"
+HASH_CHUNK_SIZE = 1 << 20
+
+# PDF merging (part size in MB, 0 writes a single file)
+DEFAULT_PDF_MAX_PART_SIZE = 0
+DEFAULT_PDF_DEDUP_RESOURCES = True
+
+# Staged asyncio pipeline (reads and writes overlap with compute, in-flight files are bounded)
+DEFAULT_PIPELINE = False
+DEFAULT_PIPELINE_IN_FLIGHT = 8
+DEFAULT_PIPELINE_QUEUE_SIZE = 4
+DEFAULT_PIPELINE_IO_WORKERS = 4
+
+# Logging and metrics (FILE_PROCESSOR_LOG_LEVEL overrides the level, third-party loggers stay at WARNING)
+DEFAULT_LOG_LEVEL = "DEBUG"
+QUIET_LOGGERS = ("PIL", "asyncio", "PyPDF2", "InquirerPy", "prompt_toolkit")
+DEFAULT_METRICS_FILE = ""
+
+# Log file rotation (rotated when it exceeds the size or the interval, old logs are gzipped)
+LOG_FILE = "file_processing.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_ROTATE_INTERVAL_HOURS = 24
+LOG_BACKUP_COUNT = 7
+LOG_RETENTION_DAYS = 30
+LOG_COMPRESS = True
+LOG_TAIL_LINES = 10
+
+# Watermark profiles (one decode, several outputs); names starting with watermarked_ are skipped as inputs
+DEFAULT_PROFILE_DRAFT = True
+DEFAULT_PROFILE_NAMING = "watermarked_{name}_{stem}{ext}"
+
+# Coordinator/worker mode (SQLite work queue, leases are renewed while a unit is being processed)
+DEFAULT_SHARD_SIZE = 64
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 5
+
+# Per-file result journal (appended as files finish, fsynced in batches) for --resume and --retry-failed
+JOURNAL_FILENAME = ".file_processor_journal.jsonl"
+JOURNAL_SYNC_EVERY = 256
+JOURNAL_SYNC_SECONDS = 2.0
+DEFAULT_RESUME = False
+DEFAULT_RETRY_FAILED = False
+
+# Output encoding (presets are defined in encoding.py: fast, balanced, small); EXIF/ICC are copied from the source
+DEFAULT_ENCODER_PRESET = "balanced"
+DEFAULT_KEEP_METADATA = True
+
+# Content-hash dedup (only files sharing size and extension are hashed, hashes are cached in the manifest).
+# Off by default: duplicates get a hardlink to the first copy's output, so editing one output changes all of them
+DEFAULT_DEDUP = False
+DEFAULT_MERGE_DEDUP = False
+DEDUP_HASH_ALGORITHM = "xxhash"
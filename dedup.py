@@ -0,0 +1,108 @@
+import os
+import shutil
+import logging
+import file_utils
+from file_utils import get_stat, hash_file, get_temp_path
+from executor import FileResult
+from metrics import count
+from config import DEDUP_HASH_ALGORITHM
+
+
+def get_dedup_algorithm():
+    # xxhash is much faster but optional; identical content is all that matters here, so sha256 works too
+    if DEDUP_HASH_ALGORITHM == "xxhash" and file_utils.xxhash is None:
+        return "sha256"
+    return DEDUP_HASH_ALGORITHM
+
+def find_duplicates(files, manifest=None, algorithm=None):
+    # Returns (unique files in input order, {unique file: [its duplicates]}).
+    # Only files sharing size and extension can be identical, so everything else is never read;
+    # hashes are cached in the manifest and reused while size and mtime are unchanged.
+    algorithm = algorithm or get_dedup_algorithm()
+    stats = {}
+    by_size = {}
+    for file in files:
+        path = os.fspath(file)
+        try:
+            stats[path] = get_stat(file)
+        except OSError:
+            continue  # Left to the action, which reports the error
+        by_size.setdefault((stats[path].st_size, os.path.splitext(path)[1].lower()), []).append(path)
+
+    canonical = {}
+    for paths in by_size.values():
+        if len(paths) < 2:
+            continue
+        first_by_digest = {}
+        for path in paths:
+            try:
+                digest = manifest.get_hash(path, algorithm, stats[path]) if manifest else None
+                if digest is None:
+                    digest = hash_file(path, algorithm)
+                    count("dedup", "hashed")
+                    if manifest:
+                        manifest.record_hash(path, algorithm, digest, stats[path])
+            except OSError as e:
+                logging.error(f"Error hashing {path} for deduplication: {str(e)}")
+                continue
+            first = first_by_digest.setdefault(digest, path)
+            if first != path:
+                canonical[path] = first
+
+    unique = []
+    duplicates = {}
+    for file in files:
+        path = os.fspath(file)
+        if path in canonical:
+            duplicates.setdefault(canonical[path], []).append(path)
+        else:
+            unique.append(file)
+    if canonical:
+        count("dedup", "duplicates", len(canonical))
+        logging.info(f"Found {len(canonical)} duplicate files, {len(unique)} unique files remain")
+    return unique, duplicates
+
+def link_or_copy(source, target):
+    # A hardlink costs no space or time; across filesystems (or where links are unsupported) fall back to a copy.
+    # The link is made under a temporary name and renamed, so the target is never missing or partial.
+    temp_path = get_temp_path(target)
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copy2(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def run_deduplicated(run, files, output_for, manifest=None, on_result=None):
+    # run(files, on_result=...) processes the unique files; each duplicate then gets the output of its
+    # original linked (or copied) to its own output path, and a result of its own
+    unique, duplicates = find_duplicates(files, manifest)
+    if not duplicates:
+        return run(unique, on_result=on_result)
+    linked = []
+
+    def handle(result):
+        if on_result:
+            on_result(result)
+        for duplicate in duplicates.get(result.path, ()):
+            if not result.success or result.skipped:
+                # Same bytes, same outcome
+                duplicate_result = FileResult(duplicate, result.success, error=result.error, skipped=result.skipped)
+            else:
+                try:
+                    link_or_copy(output_for(result.path), output_for(duplicate))
+                    count("dedup", "linked")
+                    logging.info(f"{duplicate} is identical to {result.path}, linked its output")
+                    duplicate_result = FileResult(duplicate, True)
+                except OSError as e:
+                    logging.error(f"Error linking output for duplicate {duplicate}: {str(e)}")
+                    duplicate_result = FileResult(duplicate, False, error=str(e))
+            linked.append(duplicate_result)
+            if on_result:
+                on_result(duplicate_result)
+
+    return run(unique, on_result=handle) + linked
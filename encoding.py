@@ -0,0 +1,75 @@
+import importlib
+from config import DEFAULT_ENCODER_PRESET, DEFAULT_KEEP_METADATA
+
+# Encoder settings per speed/size preset and format, passed straight to Image.save().
+# "balanced" stays close to Pillow's defaults (plus the lossless JPEG optimize pass);
+# "fast" trades output bytes for encode time, "small" the other way round.
+ENCODER_PRESETS = {
+    "fast": {
+        "jpeg": {"quality": 75, "subsampling": "4:2:0", "optimize": False, "progressive": False},
+        "png": {"compress_level": 1},
+        "webp": {"quality": 80, "method": 0, "lossless": False},
+        "avif": {"quality": 75, "speed": 8}
+    },
+    "balanced": {
+        "jpeg": {"quality": 75, "subsampling": "4:2:0", "optimize": True, "progressive": False},
+        "png": {"compress_level": 6},
+        "webp": {"quality": 80, "method": 4, "lossless": False},
+        "avif": {"quality": 75, "speed": 6}
+    },
+    "small": {
+        "jpeg": {"quality": 70, "subsampling": "4:2:0", "optimize": True, "progressive": True},
+        "png": {"compress_level": 9, "optimize": True},
+        "webp": {"quality": 75, "method": 6, "lossless": False},
+        "avif": {"quality": 65, "speed": 3}
+    }
+}
+
+# Metadata Pillow can write back for each format
+METADATA_KEYS = {
+    "jpeg": ("exif", "icc_profile"),
+    "png": ("exif", "icc_profile"),
+    "webp": ("exif", "icc_profile"),
+    "avif": ("exif", "icc_profile")
+}
+
+
+def normalize_format(image_format):
+    image_format = image_format.lower()
+    return "jpeg" if image_format == "jpg" else image_format
+
+def get_encoder_options(image_format, preset=DEFAULT_ENCODER_PRESET, overrides=None):
+    if preset not in ENCODER_PRESETS:
+        raise ValueError(f"Unknown encoder preset: {preset}, choose one of {', '.join(ENCODER_PRESETS)}")
+    options = dict(ENCODER_PRESETS[preset].get(normalize_format(image_format), {}))
+    # Explicit settings (e.g. a profile's quality) win over the preset; None means "use the preset"
+    options.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return options
+
+def get_metadata_options(image_format, info):
+    # info is the source image's Image.info, which Pillow fills with the raw EXIF and ICC blocks
+    if not info:
+        return {}
+    return {key: info[key] for key in METADATA_KEYS.get(normalize_format(image_format), ()) if info.get(key)}
+
+def ensure_encoder(image_format):
+    # AVIF ships with Pillow 11.2+, older versions need the optional pillow-avif-plugin package
+    if normalize_format(image_format) != "avif":
+        return
+    for module in ("PIL.AvifImagePlugin", "pillow_avif"):
+        try:
+            importlib.import_module(module)
+            return
+        except ImportError:
+            continue
+    raise ValueError("AVIF output requires Pillow 11.2+ or the optional 'pillow-avif-plugin' package")
+
+def save_image(image, output, image_format, preset=DEFAULT_ENCODER_PRESET, info=None, keep_metadata=DEFAULT_KEEP_METADATA, overrides=None):
+    image_format = normalize_format(image_format)
+    ensure_encoder(image_format)
+    if image_format == "jpeg" and image.mode not in ("RGB", "L", "CMYK"):
+        image = image.convert("RGB")
+    options = get_encoder_options(image_format, preset, overrides)
+    if keep_metadata:
+        options.update(get_metadata_options(image_format, info))
+    image.save(output, format=image_format, **options)
@@ -0,0 +1,119 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import METRICS, count
+from config import DEFAULT_WORKERS, DEFAULT_CHUNK_SIZE
+
+
+class FileResult:
+    def __init__(self, path, success, error=None, skipped=False, value=None):
+        self.path = path
+        self.success = success
+        self.error = error
+        self.skipped = skipped
+        self.value = value
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "success": self.success,
+            "error": self.error,
+            "skipped": self.skipped
+        }
+
+
+def resolve_workers(workers):
+    # 0 or None means one worker per core
+    if not workers or workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+def run_file_task(func, path):
+    try:
+        value = func(path)
+        if isinstance(value, FileResult):
+            return value
+        return FileResult(path, True, value=value)
+    except Exception as e:
+        return FileResult(path, False, error=str(e))
+
+def init_worker_process(initializer=None, initargs=()):
+    # Forked workers inherit the parent's measurements, which would be counted twice when merged back
+    METRICS.reset()
+    if initializer:
+        initializer(*initargs)
+
+def _run_chunk(func, chunk, collect_metrics=False):
+    results = [run_file_task(func, path) for path in chunk]
+    if collect_metrics:
+        # Worker processes send their timers and counters back with the results
+        return results, METRICS.drain()
+    return results
+
+def _iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_results(func, items, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, initializer=None, initargs=(), use_threads=False):
+    workers = resolve_workers(workers)
+    if workers == 1:
+        if initializer:
+            initializer(*initargs)
+        for item in items:
+            yield run_file_task(func, item)
+        return
+
+    pool_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    collect_metrics = not use_threads
+    if collect_metrics:
+        initializer, initargs = init_worker_process, (initializer, initargs)
+    with pool_class(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for chunk in _iter_chunks(items, max(1, chunk_size)):
+            pending.append(pool.submit(_run_chunk, func, chunk, collect_metrics))
+            # Only keep a couple of chunks per worker in flight so huge inputs are not queued up front
+            if len(pending) >= workers * 2:
+                yield from _chunk_results(pending.popleft(), collect_metrics)
+        while pending:
+            yield from _chunk_results(pending.popleft(), collect_metrics)
+
+def _chunk_results(future, collect_metrics):
+    if not collect_metrics:
+        return future.result()
+    results, snapshot = future.result()
+    METRICS.merge(snapshot)
+    return results
+
+def run_parallel(func, items, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, initializer=None, initargs=(), use_threads=False, on_result=None):
+    # on_result(result) sees every result as soon as its chunk is back, e.g. to journal progress
+    results = []
+    for result in iter_results(func, items, workers, chunk_size, initializer, initargs, use_threads):
+        if on_result:
+            on_result(result)
+        results.append(result)
+    return results
+
+def summarize_results(results, action_name):
+    succeeded = 0
+    skipped = 0
+    failed = 0
+    for result in results:
+        if not result.success:
+            failed += 1
+            logging.error(f"{action_name} failed for {result.path}: {result.error}")
+        elif result.skipped:
+            skipped += 1
+        else:
+            succeeded += 1
+    count(action_name, "files", succeeded)
+    count(action_name, "errors", failed)
+    count(action_name, "skipped", skipped)
+    logging.info(f"{action_name}: {succeeded} succeeded, {failed} failed, {skipped} skipped")
+    return failed == 0, failed > 0
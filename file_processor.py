@@ -1,22 +1,45 @@
+import time
+startup_started = time.perf_counter()  # Taken before the remaining imports so --profile-startup can time them
 import argparse
+import inspect
 import logging
 import json
 import os
-from InquirerPy import prompt
-import importlib
+import sys
 import logger_config  # This initializes the logging configuration
-from file_utils import show_log_tail
-from options_mapping import main_menu_question, log_option_question, get_action_details
+from logger_config import set_log_level, flush_logs
+from metrics import METRICS, export_metrics, profile_call
+from file_utils import show_log_tail, load_json_or_yaml
+from options_mapping import main_menu_question, log_option_question, get_action_details, actions
+from action_registry import StartupProfile, get_registered_actions, load_action
 from config import (
     DEFAULT_WATERMARK_SIZE,
     DEFAULT_WATERMARK_TRANSPARENCY,
     DEFAULT_FONT_SIZE,
     DEFAULT_SOFT_EDGE,
     DEFAULT_INCLUDE_DATE,
-    DEFAULT_SAME_POSITION
+    DEFAULT_SAME_POSITION,
+    DEFAULT_METRICS_FILE,
+    DEFAULT_SHARD_SIZE,
+    DEFAULT_LEASE_SECONDS,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_POLL_INTERVAL
 )
 
+startup_profile = StartupProfile(startup_started)
+startup_profile.mark("imports")
+
 CONFIG_FILE = 'last_request.json'
+INTEGER_PARAMS = ['size', 'transparency', 'font_size', 'soft_edge_width', 'rows', 'workers', 'chunk_size', 'max_tile_size', 'max_part_size', 'in_flight']
+# Flags that configure the CLI itself rather than the action
+GLOBAL_ARGS = ("full", "profile_startup", "log_level", "metrics_file", "profile")
+# Prompts that only steer the interactive flow and have no command-line flag
+INTERACTIVE_ONLY_PARAMS = ['additional_params']
+
+def prompt(questions):
+    # InquirerPy is only needed for interactive runs, so headless runs never pay for importing it
+    from InquirerPy import prompt as inquirer_prompt
+    return inquirer_prompt(questions)
 
 def save_request(data):
     with open(CONFIG_FILE, 'w') as f:
@@ -58,11 +81,274 @@ def get_params(action_details, previous=None):
         context[param_name] = response
     return params
 
-def main():
+def normalize_params(params):
+    params = dict(params)
+    # Remove 'additional_params' and 'same_position' key from params if they exist
+    if 'additional_params' in params:
+        del params['additional_params']
+    if 'same_position' in params:
+        same_position = params.pop('same_position')
+    else:
+        # Headless runs and jobs never answer the prompt, so an explicit text_position wins over the default
+        same_position = DEFAULT_SAME_POSITION and 'text_position' not in params
+    
+    # Convert numeric parameters to integers if present
+    for key in INTEGER_PARAMS:
+        if key in params:
+            try:
+                params[key] = int(params[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a whole number, got {params[key]!r}")
+
+    # Set text_position to image_position if same_position is True
+    if same_position and 'image_position' in params:
+        params['text_position'] = params['image_position']
+    return params
+
+def run_action(action_details, directory, params):
+    success = False
+    partial_success = False
+    if action_details.module and action_details.function:
+        try:
+            action_function = load_action(action_details)
+            startup_profile.mark(f"load {action_details.get_action_name()}")
+            success, partial_success = action_function(directory, **params)
+            startup_profile.mark(f"run {action_details.get_action_name()}")
+        except Exception as e:
+            logging.error(f"Error processing action {action_details.get_action_name()}: {str(e)}")
+            success, partial_success = False, False
+    return success, partial_success
+
+def get_status(success, partial_success):
+    if success and not partial_success:
+        return "success"
+    if partial_success:
+        return "partial"
+    return "failed"
+
+def build_parser():
     parser = argparse.ArgumentParser(description="File Processor Script")
     parser.add_argument('-f', '--full', action='store_true', help='Show full log')
+    parser.add_argument('--profile-startup', action='store_true', help='Print a startup timing report to stderr on exit')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper, help='Log level for file_processing.log')
+    parser.add_argument('--metrics-file', default=DEFAULT_METRICS_FILE, help='Export stage timings and counters on exit (.prom for a Prometheus textfile, anything else appends JSON lines)')
+    parser.add_argument('--profile', metavar='STATS_FILE', help='Run under cProfile and write the stats to this file')
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Run a single action without prompts")
+    run_parser.add_argument('--summary-file', help='Also write the JSON summary to this file')
+    action_parsers = run_parser.add_subparsers(dest="action", required=True)
+    for action in get_registered_actions(actions):
+        action_parser = action_parsers.add_parser(action.get_action_name(), help=action.description)
+        action_parser.add_argument("directory", help="Directory to process")
+        add_param_arguments(action_parser, action.params)
+
+    job_parser = subparsers.add_parser("job", help="Run every job listed in a JSON or YAML job file")
+    job_parser.add_argument("job_file", help="Path to the job file")
+    job_parser.add_argument('--stop-on-error', action='store_true', help='Stop at the first job that does not fully succeed')
+    job_parser.add_argument('--summary-file', help='Also write the JSON summary to this file')
+
+    # Coordinator/worker mode: split one action into work units in a shared SQLite queue
+    from work_queue import SHARDABLE_ACTIONS
+    coordinate_parser = subparsers.add_parser("coordinate", help="Queue an action as work units for worker processes")
+    coordinate_parser.add_argument('--queue', required=True, help='Path to the SQLite work queue (created if missing)')
+    coordinate_parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='Files per work unit')
+    coordinate_parsers = coordinate_parser.add_subparsers(dest="action", required=True)
+    for action in get_registered_actions(actions):
+        if action.get_action_name() in SHARDABLE_ACTIONS:
+            action_parser = coordinate_parsers.add_parser(action.get_action_name(), help=action.description)
+            action_parser.add_argument("directory", help="Directory to process")
+            add_param_arguments(action_parser, action.params)
+
+    worker_parser = subparsers.add_parser("worker", help="Process work units from a queue until it is drained")
+    worker_parser.add_argument('--queue', required=True, help='Path to the SQLite work queue')
+    worker_parser.add_argument('--worker-id', help='Name recorded on leases and results (default: host:pid)')
+    worker_parser.add_argument('--directory', help='Where this host mounts the run directory, if it differs from the coordinator')
+    worker_parser.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help='Lease length in seconds, renewed while a unit is processed')
+    worker_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Attempts before a unit is marked failed')
+    worker_parser.add_argument('--poll-interval', type=int, default=DEFAULT_POLL_INTERVAL, help='Seconds between polls while other workers hold leases')
+    worker_parser.add_argument('--wait', action='store_true', help='Keep polling for new work instead of exiting when the queue is drained')
+
+    status_parser = subparsers.add_parser("queue-status", help="Print the progress of every run in a queue")
+    status_parser.add_argument('--queue', required=True, help='Path to the SQLite work queue')
+    return parser
+
+def add_param_arguments(parser, params):
+    # Flags mirror the prompt schema in options_mapping; unset flags fall back to the action's own defaults
+    for param in params:
+        if param["name"] in INTERACTIVE_ONLY_PARAMS:
+            continue
+        flag = "--" + param["name"].replace("_", "-")
+        help_text = param["message"].split(" ", 1)[-1].replace("%", "%%")
+        if param["type"] == "confirm":
+            parser.add_argument(flag, dest=param["name"], action=argparse.BooleanOptionalAction, default=argparse.SUPPRESS, help=help_text)
+        elif param["type"] == "list":
+            parser.add_argument(flag, dest=param["name"], choices=param["choices"], default=argparse.SUPPRESS, help=help_text)
+        elif param["name"] in INTEGER_PARAMS:
+            parser.add_argument(flag, dest=param["name"], type=int, default=argparse.SUPPRESS, help=help_text)
+        else:
+            parser.add_argument(flag, dest=param["name"], default=argparse.SUPPRESS, help=help_text)
+
+def load_jobs(job_file):
+    data = load_json_or_yaml(job_file, "job")
+    if isinstance(data, dict):
+        data = data.get("jobs", [])
+    if data and not isinstance(data, list):
+        raise ValueError("Job file must contain a list of jobs or {\"jobs\": [...]}")
+    return data or []
+
+def fill_required_params(action_details, params):
+    # Headless runs only pass the flags that were given. Required arguments fall back to the prompt's
+    # default; a blank default is no value, so those are returned as missing along with the rest.
+    params = dict(params)
+    try:
+        signature = inspect.signature(load_action(action_details))
+    except (ImportError, ValueError) as e:
+        logging.error(f"Error loading action {action_details.get_action_name()}: {str(e)}")
+        return params, []
+    defaults = {param["name"]: param["default"] for param in action_details.params if "default" in param}
+    missing = []
+    for name, parameter in list(signature.parameters.items())[1:]:
+        if parameter.default is not inspect.Parameter.empty or parameter.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD) or name in params:
+            continue
+        if defaults.get(name) not in (None, ""):
+            params[name] = defaults[name]
+        else:
+            missing.append(name)
+    return params, missing
+
+def run_job(job):
+    started = time.perf_counter()
+    result = {"action": "", "directory": ""}
+    # A bad entry fails only its own job, the runner carries on and still prints the summary
+    try:
+        if not isinstance(job, dict):
+            raise ValueError(f"Job entries must be mappings, got {type(job).__name__}: {job!r}")
+        action_name = job.get("action", "")
+        directory = job.get("directory", "")
+        result.update({"action": action_name, "directory": directory})
+        action_details = get_action_details(action_name)
+        if action_details is None or not action_details.module:
+            logging.error(f"Unknown action in job: {action_name}")
+            result.update({"status": "failed", "error": f"Unknown action: {action_name}"})
+        elif not directory or not os.path.isdir(directory):
+            logging.error(f"Directory not found for job {action_name}: {directory}")
+            result.update({"status": "failed", "error": f"Directory not found: {directory}"})
+        else:
+            params = job.get("params") or {}
+            if not isinstance(params, dict):
+                raise ValueError(f"Job params must be a mapping, got {type(params).__name__}")
+            params, missing = fill_required_params(action_details, params)
+            if missing:
+                logging.error(f"Missing required parameters for job {action_name}: {', '.join(missing)}")
+                result.update({"status": "failed", "error": f"Missing required parameters: {', '.join(missing)}"})
+            else:
+                params = normalize_params(params)
+                logging.debug(f"Headless job: {action_name} in {directory} with {params}")
+                result["params"] = params
+                result["status"] = get_status(*run_action(action_details, directory, params))
+    except Exception as e:
+        logging.error(f"Error running job {result['action']}: {str(e)}")
+        result.update({"status": "failed", "error": str(e)})
+    result["duration"] = round(time.perf_counter() - started, 3)
+    return result
+
+def run_headless(jobs, summary_file=None, stop_on_error=False):
+    started = time.perf_counter()
+    results = []
+    for job in jobs:
+        result = run_job(job)
+        results.append(result)
+        if stop_on_error and result["status"] != "success":
+            break
+    summary = {
+        "jobs": results,
+        "succeeded": sum(1 for result in results if result["status"] == "success"),
+        "partial": sum(1 for result in results if result["status"] == "partial"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "skipped": len(jobs) - len(results),
+        "duration": round(time.perf_counter() - started, 3),
+        "metrics": METRICS.snapshot()
+    }
+    output = json.dumps(summary, default=str)
+    print(output)
+    if summary_file:
+        with open(summary_file, 'w') as f:
+            f.write(output)
+    # Exit codes for schedulers: 0 all succeeded, 2 partial success, 1 any failure
+    if summary["failed"] or summary["skipped"]:
+        return 1
+    if summary["partial"]:
+        return 2
+    return 0
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
+    startup_profile.enabled = args.profile_startup
+    startup_profile.mark("parse_args")
+    if args.log_level:
+        set_log_level(args.log_level)
+    try:
+        if args.profile:
+            return profile_call(dispatch, args.profile, args, parser)
+        return dispatch(args, parser)
+    finally:
+        if args.metrics_file:
+            export_metrics(args.metrics_file, labels={"command": args.command or "interactive"})
+        startup_profile.print_report()
+
+def dispatch(args, parser=None):
+    if args.command == "run":
+        params = {key: value for key, value in vars(args).items() if key not in GLOBAL_ARGS + ("command", "action", "directory", "summary_file")}
+        _, missing = fill_required_params(get_action_details(args.action), params)
+        if missing and parser:
+            parser.error(f"run {args.action}: the following arguments are required: {', '.join('--' + name.replace('_', '-') for name in missing)}")
+        return run_headless([{"action": args.action, "directory": args.directory, "params": params}], args.summary_file)
+    if args.command == "job":
+        try:
+            jobs = load_jobs(args.job_file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading job file {args.job_file}: {str(e)}")
+            print(json.dumps({"jobs": [], "error": str(e)}))
+            return 1
+        return run_headless(jobs, args.summary_file, args.stop_on_error)
+    if args.command in ("coordinate", "worker", "queue-status"):
+        return run_queue_command(args)
 
+    interactive_main(args)
+    return 0
+
+def run_queue_command(args):
+    import work_queue
+    try:
+        if args.command == "coordinate":
+            if not os.path.isdir(args.directory):
+                raise ValueError(f"Directory not found: {args.directory}")
+            params, missing = fill_required_params(get_action_details(args.action), {key: value for key, value in vars(args).items() if key not in GLOBAL_ARGS + ("command", "action", "directory", "queue", "shard_size")})
+            if missing:
+                raise ValueError(f"Missing required parameters: {', '.join(missing)}")
+            params = normalize_params(params)
+            run_id, units = work_queue.submit_run(args.queue, args.action, args.directory, params, args.shard_size)
+            summary = {"run_id": run_id, "action": args.action, "directory": args.directory, "units": units}
+        elif args.command == "worker":
+            summary = work_queue.run_worker(args.queue, args.worker_id, args.directory, args.lease, args.max_attempts, args.poll_interval, args.wait)
+            summary["metrics"] = METRICS.snapshot()
+        else:
+            queue = work_queue.WorkQueue(args.queue)
+            try:
+                summary = queue.status()
+            finally:
+                queue.close()
+    except Exception as e:
+        logging.error(f"Error running {args.command} on queue {args.queue}: {str(e)}")
+        print(json.dumps({"error": str(e)}))
+        return 1
+    print(json.dumps(summary, default=str))
+    # Same exit codes as headless runs: a worker that saw failed files or units reports 1
+    return 1 if summary.get("files_failed") or summary.get("units_failed") else 0
+
+def interactive_main(args):
     previous_request = load_request()
     action_display = get_action()
     
@@ -108,36 +394,11 @@ def main():
     logging.debug(f"Directory: {directory}")
     logging.debug(f"Parameters: {params}")
 
-    # Remove 'additional_params' and 'same_position' key from params if they exist
-    if 'additional_params' in params:
-        del params['additional_params']
-    if 'same_position' in params:
-        same_position = params.pop('same_position')
-    else:
-        same_position = DEFAULT_SAME_POSITION
-    
-    # Convert size, transparency, font_size, and rows to integers if present
-    for key in ['size', 'transparency', 'font_size', 'rows']:
-        if key in params:
-            params[key] = int(params[key])
-
-    # Set text_position to image_position if same_position is True
-    if same_position and 'image_position' in params:
-        params['text_position'] = params['image_position']
+    params = normalize_params(params)
 
     print(f"🍒 Processing files in directory: {directory} with parameters: {params}")
 
-    success = False
-    partial_success = False
-
-    if action_details.module and action_details.function:
-        try:
-            module = importlib.import_module(action_details.module)
-            action_function = getattr(module, action_details.function)
-            success, partial_success = action_function(directory, **params)
-        except Exception as e:
-            logging.error(f"Error processing action {action_details.get_action_name()}: {str(e)}")
-            print(f"❌ Operation failed. Please see the log for details.")
+    success, partial_success = run_action(action_details, directory, params)
 
     if action_details.name != "Load last request":
         request_data = {
@@ -156,10 +417,12 @@ def main():
     
     show_log = prompt([log_option_question])["show_log"]
     if show_log and not success:
+        flush_logs()
         show_log_tail(args.full)
 
 if __name__ == "__main__":
-    main()
+    exit_code = main()
     for handler in logging.root.handlers[:]:
         handler.close()
         logging.root.removeHandler(handler)
+    sys.exit(exit_code)
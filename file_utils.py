@@ -1,38 +1,193 @@
 import os
+import sys
+import json
+import stat
+import time
+import shutil
+import hashlib
 import logging
+from fnmatch import fnmatch
+from contextlib import contextmanager
+from metrics import METRICS, timer
+from config import MANIFEST_FILENAME, JOURNAL_FILENAME, HASH_CHUNK_SIZE, LOG_FILE, LOG_TAIL_LINES
 
-def get_files_to_process(directory, include_subdirectories=True):
-    files_to_process = []
-    for root, _, files in os.walk(directory):
-        if not include_subdirectories and root != directory:
-            continue
-        for file in files:
-            file_path = os.path.join(root, file)
-            files_to_process.append(file_path)
-    return files_to_process
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Outputs written by the actions themselves, which must never be fed back in as inputs
+GENERATED_PREFIXES = ("watermarked_", "merged_file_part")
+GENERATED_FILES = {
+    "merged_file.pdf", "merged_image.jpg", "merged_image.png",
+    "metadata.json", "metadata.ndjson", "metadata.csv", "metadata.parquet",
+    MANIFEST_FILENAME, JOURNAL_FILENAME
+}
+
+def is_generated_file(file_path):
+    name = os.path.basename(file_path)
+    if name.startswith('.') and name.endswith('.tmp'):
+        return True  # An output still being written, see get_temp_path
+    return name in GENERATED_FILES or name.startswith(GENERATED_PREFIXES)
+
+def is_hidden(entry):
+    if entry.name.startswith('.'):
+        return True
+    if os.name == 'nt':
+        # On Windows scandir already carries the attributes, so this costs no extra call
+        return bool(entry.stat().st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+    return False
+
+def iter_files(directory, include_subdirectories=True, extensions=None, patterns=None, skip_hidden=False, skip_generated=False):
+    # Lazily yields os.DirEntry objects (top-down, like os.walk) so work can start on the first match
+    if extensions:
+        extensions = tuple(extension.lower() for extension in extensions)
+    pending_directories = [directory]
+    # Only time spent inside the generator counts as discovery, not the consumer's work between yields
+    elapsed = 0.0
+    resumed = time.perf_counter()
+    try:
+        while pending_directories:
+            current = pending_directories.pop()
+            subdirectories = []
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if skip_hidden and is_hidden(entry):
+                            continue
+                        try:
+                            if entry.is_dir():
+                                # Like os.walk, symlinked directories are not followed
+                                if include_subdirectories and not entry.is_symlink():
+                                    subdirectories.append(entry.path)
+                                continue
+                        except OSError:
+                            continue
+                        if skip_generated and is_generated_file(entry.name):
+                            continue
+                        if extensions and not entry.name.lower().endswith(extensions):
+                            continue
+                        if patterns and not any(fnmatch(entry.name, pattern) for pattern in patterns):
+                            continue
+                        elapsed += time.perf_counter() - resumed
+                        resumed = None
+                        yield entry
+                        resumed = time.perf_counter()
+            except OSError as e:
+                logging.error(f"Error scanning directory {current}: {str(e)}")
+            pending_directories.extend(reversed(subdirectories))
+    finally:
+        if resumed is not None:
+            elapsed += time.perf_counter() - resumed
+        METRICS.observe("discovery", elapsed)
+
+def get_files_to_process(directory, include_subdirectories=True, skip_generated=False, extensions=None, patterns=None, skip_hidden=False):
+    return [entry.path for entry in iter_files(directory, include_subdirectories, extensions, patterns, skip_hidden, skip_generated)]
+
+def get_stat(file):
+    # DirEntry caches its stat result, so files found by iter_files are not stat'ed twice
+    if isinstance(file, os.DirEntry):
+        return file.stat()
+    return os.stat(file)
 
 def get_metadata(file):
     metadata = {}
     try:
-        stat_info = os.stat(file)
+        stat_info = get_stat(file)
         metadata = {
             "size": stat_info.st_size,
             "modified_time": stat_info.st_mtime,
             "created_time": stat_info.st_ctime
         }
     except Exception as e:
-        logging.error(f"Error getting metadata for {file}: {str(e)}")
+        logging.error(f"Error getting metadata for {os.fspath(file)}: {str(e)}")
     return metadata
 
-def show_log_tail(full_log=False):
-    log_file = 'file_processing.log'
+def get_temp_path(path):
+    # Hidden, in the same directory (so the final rename never crosses filesystems) and unique per process
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+
+@contextmanager
+def atomic_output(path):
+    # Yields a temporary path to write to, which replaces path only once the block completes.
+    # Readers (and a resumed run) only ever see the old file or the complete new one, never half of it.
+    temp_path = get_temp_path(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_file_atomic(path, data):
+    with atomic_output(path) as temp_path:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+def load_json_or_yaml(path, kind="input"):
+    # .yaml/.yml files need the optional PyYAML package, anything else is read as JSON
+    with open(path, 'r') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"YAML {kind} files require the optional 'PyYAML' package")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def check_hash_algorithm(algorithm):
+    if algorithm == "xxhash":
+        if xxhash is None:
+            raise ValueError("xxhash hashing requires the optional 'xxhash' package")
+        return
+    try:
+        hashlib.new(algorithm)
+    except (ValueError, TypeError):
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+
+def hash_file(file, algorithm="sha256", chunk_size=HASH_CHUNK_SIZE):
+    if algorithm == "xxhash":
+        check_hash_algorithm(algorithm)
+        digest = xxhash.xxh3_64()
+    else:
+        digest = hashlib.new(algorithm)
+    # Read in large chunks into one reusable buffer
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with timer("hash"), open(os.fspath(file), 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+def show_log_tail(full_log=False, log_file=LOG_FILE, line_count=LOG_TAIL_LINES):
     if not os.path.exists(log_file):
         print("Log file does not exist.")
         return
 
-    with open(log_file, 'r') as f:
-        if full_log:
-            log_content = f.read()
-        else:
-            log_content = f.readlines()[-10:]  # Show last 10 lines
-    print("".join(log_content))
+    if full_log:
+        # Stream the file instead of loading it into memory
+        with open(log_file, 'r', errors='replace') as f:
+            shutil.copyfileobj(f, sys.stdout)
+        print()
+        return
+    print("".join(tail_lines(log_file, line_count)))
+
+def tail_lines(path, line_count=LOG_TAIL_LINES, block_size=8192):
+    # Reads fixed-size blocks backwards from the end until enough lines are found, so memory
+    # depends on the length of the last lines and not on the size of the file
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= line_count:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return lines[-line_count:] if line_count > 0 else []
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from file_utils import write_file_atomic
+from config import JOURNAL_FILENAME, JOURNAL_SYNC_EVERY, JOURNAL_SYNC_SECONDS
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Journal:
+    # Append-only JSON lines with the outcome of every file, written as results come in.
+    # Entries are grouped by run key (the action's parameter hash), the last entry for a file wins.
+    # Lines are flushed and fsynced in batches, so a crash loses at most the last batch of outcomes
+    # and those files are simply processed again on resume.
+    def __init__(self, directory, action, run_key, sync_every=JOURNAL_SYNC_EVERY, sync_seconds=JOURNAL_SYNC_SECONDS):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL_FILENAME)
+        self.action = action
+        self.run_key = run_key
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.outcomes = {}
+        self.handle = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A torn last line from a crash
+                    if entry.get("action") == self.action and entry.get("run") == self.run_key:
+                        self.outcomes[entry["path"]] = entry["status"]
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Ignoring unreadable journal {self.path}: {str(e)}")
+
+    def _key(self, path):
+        return os.path.relpath(os.fspath(path), self.directory)
+
+    def status(self, path):
+        return self.outcomes.get(self._key(path))
+
+    def should_process(self, path, resume=False, retry_failed=False):
+        status = self.status(path)
+        if retry_failed:
+            return status == FAILED
+        if resume:
+            return status not in (DONE, SKIPPED)
+        return True
+
+    def finished(self, files):
+        # Files this run already completed before an interruption
+        return [file for file in files if self.status(file) in (DONE, SKIPPED)]
+
+    def filter_files(self, files, resume=False, retry_failed=False):
+        # Lazy, so discovery can still stream into the workers
+        return (file for file in files if self.should_process(file, resume, retry_failed))
+
+    def record(self, result):
+        if not result.success:
+            status = FAILED
+        elif result.skipped:
+            status = SKIPPED
+        else:
+            status = DONE
+        key = self._key(result.path)
+        self.outcomes[key] = status
+        if self.handle is None:
+            self.handle = open(self.path, 'a')
+        entry = {"run": self.run_key, "action": self.action, "path": key, "status": status, "time": datetime.now().isoformat(timespec="seconds")}
+        if result.error:
+            entry["error"] = result.error
+        self.handle.write(json.dumps(entry) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def sync(self):
+        if self.handle is None or not self.unsynced:
+            return
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.handle is not None:
+            self.sync()
+            self.handle.close()
+            self.handle = None
+
+    def compact(self):
+        # Keeps only the last entry per action, run key and file, so the journal does not grow with every run.
+        # Called after a clean run; the rewrite is atomic, so a crash leaves the old journal in place.
+        self.close()
+        latest = {}
+        line_count = 0
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    line_count += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest[(entry.get("action"), entry.get("run"), entry.get("path"))] = line if line.endswith("\n") else line + "\n"
+            if len(latest) < line_count:
+                write_file_atomic(self.path, "".join(latest.values()).encode('utf-8'))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not compact journal {self.path}: {str(e)}")
+
+    def counts(self):
+        counts = {DONE: 0, FAILED: 0, SKIPPED: 0}
+        for status in self.outcomes.values():
+            counts[status] += 1
+        return counts
+
+
+def run_journaled(run, files, journal, manifest=None, incremental=False, outputs_for=None, resume=False, retry_failed=False):
+    # Shared by the per-file actions. run(files, on_result=...) gets the files left after skipping those
+    # unchanged since the last run (incremental, needs the manifest) and those this run already finished
+    # (resume / retry_failed). Every outcome is journaled as it arrives and successes are recorded in the
+    # manifest, so an interrupted run keeps its progress; the journal is compacted after a clean run.
+    # Without a manifest files stream straight into run, with one they are listed first.
+    # The journal is closed here. Returns the results, an empty list when nothing was left to do.
+    pending = files
+    if resume or retry_failed:
+        counts = journal.counts()
+        logging.info(f"Journal of the last run: {counts[DONE]} done, {counts[FAILED]} failed, {counts[SKIPPED]} skipped")
+    if incremental:
+        pending = manifest.filter_changed(files, journal.action, journal.run_key, outputs_for)
+        logging.info(f"Skipping {len(files) - len(pending)} unchanged files, {len(pending)} to process")
+        if resume or retry_failed:
+            # Files finished before the interruption never made it into the manifest
+            for path in journal.finished(pending):
+                manifest.record(path, journal.action, journal.run_key, pending[path])
+
+    def record_result(result):
+        journal.record(result)
+        if incremental and result.success and not result.skipped:
+            manifest.record(result.path, journal.action, journal.run_key, pending[result.path])
+            manifest.checkpoint()
+
+    try:
+        remaining = journal.filter_files(pending, resume, retry_failed)
+        if manifest is not None:
+            remaining = list(remaining)
+        results = run(remaining, on_result=record_result)
+    finally:
+        journal.close()
+        if manifest is not None:
+            manifest.save()
+    if results and all(result.success for result in results):
+        journal.compact()
+    return results
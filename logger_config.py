@@ -1,8 +1,152 @@
+import os
+import gzip
+import time
+import queue
+import atexit
+import shutil
 import logging
+import logging.handlers
+from config import (
+    DEFAULT_LOG_LEVEL,
+    QUIET_LOGGERS,
+    LOG_FILE,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_INTERVAL_HOURS,
+    LOG_BACKUP_COUNT,
+    LOG_RETENTION_DAYS,
+    LOG_COMPRESS
+)
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'  # Prefix of the default asctime
+
+listener = None
+
+def get_log_level(level):
+    level = str(level or DEFAULT_LOG_LEVEL).upper()
+    return level if isinstance(logging.getLevelName(level), int) else DEFAULT_LOG_LEVEL
+
+def set_log_level(level):
+    logging.getLogger().setLevel(get_log_level(level))
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    # Rotates by size like RotatingFileHandler and additionally once the file is older than the interval.
+    # Rotated files are gzipped (file_processing.log.1.gz, .2.gz, ...) and pruned by count and by age.
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, interval_hours=LOG_ROTATE_INTERVAL_HOURS, backup_count=LOG_BACKUP_COUNT, retention_days=LOG_RETENTION_DAYS, compress=LOG_COMPRESS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval_hours * 3600
+        self.retention = retention_days * 86400
+        self.compress = compress
+        self.rollover_at = None
+
+    def get_started(self):
+        # The mtime moves with every write, so the age comes from the timestamp on the file's first line
+        try:
+            with open(self.baseFilename, 'r', errors='replace') as f:
+                first_line = f.readline()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            return time.time()
+        try:
+            return time.mktime(time.strptime(first_line[:19], LOG_DATE_FORMAT))
+        except ValueError:
+            return time.time()
+
+    def shouldRollover(self, record):
+        if self.interval:
+            if self.rollover_at is None:
+                # A missing file is started by this record
+                self.rollover_at = (self.get_started() or time.time()) + self.interval
+            if time.time() >= self.rollover_at and os.path.exists(self.baseFilename):
+                return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+        self.remove_expired()
+
+    def rotation_filename(self, default_name):
+        return f"{default_name}.gz" if self.compress else default_name
+
+    def rotate(self, source, dest):
+        if not self.compress:
+            super().rotate(source, dest)
+            return
+        # Runs on the listener thread, so callers never wait for the compression. The log is renamed first,
+        # so forked workers see the new inode and reopen right away instead of writing into the old file.
+        temp_path = f"{dest}.tmp"
+        os.replace(source, temp_path)
+        with open(temp_path, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(temp_path)
+
+    def remove_expired(self):
+        if not self.retention:
+            return
+        directory, name = os.path.split(self.baseFilename)
+        cutoff = time.time() - self.retention
+        for file_name in os.listdir(directory or "."):
+            path = os.path.join(directory, file_name)
+            if file_name.startswith(f"{name}.") and os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class ProcessAwareQueueHandler(logging.handlers.QueueHandler):
+    # Forked workers inherit this handler but not the listener thread, so they append to the log directly.
+    # WatchedFileHandler reopens the file once the listener has rotated it away, so later lines land in the new log,
+    # and the size check the listener makes on its next write includes what the workers wrote.
+    def __init__(self, log_queue, filename):
+        super().__init__(log_queue)
+        self.pid = os.getpid()
+        self.filename = filename
+        self.direct_handler = None
+
+    def emit(self, record):
+        if os.getpid() == self.pid:
+            super().emit(record)
+            return
+        if self.direct_handler is None:
+            self.direct_handler = logging.handlers.WatchedFileHandler(self.filename)
+            self.direct_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.direct_handler.emit(record)
+
+def configure_logging(filename=LOG_FILE, level=None):
+    global listener
+    file_handler = RotatingLogHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    # Log calls only enqueue the record; a single listener thread formats, writes and rotates
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=False)
+    listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    root.addHandler(ProcessAwareQueueHandler(log_queue, filename))
+    root.setLevel(get_log_level(level or os.environ.get("FILE_PROCESSOR_LOG_LEVEL")))
+
+    # Pillow plugin imports, PNG chunk parsing and asyncio internals log at DEBUG and drown our own messages
+    for logger_name in QUIET_LOGGERS:
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+def flush_logs():
+    # Waits until every queued record has been written, e.g. before showing the log tail
+    if listener is not None:
+        listener.stop()
+        listener.start()
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
 
 # Configure logging to only log to a file and not to the console
-logging.basicConfig(
-    filename='file_processing.log',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+configure_logging()
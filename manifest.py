@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from file_utils import get_stat, write_file_atomic
+from config import MANIFEST_FILENAME, MANIFEST_SAVE_SECONDS
+
+
+def hash_params(action, params):
+    payload = json.dumps({"action": action, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def get_file_signature(path):
+    # Size and mtime of a parameter file (e.g. the watermark image), so editing it invalidates the manifest
+    try:
+        stat_info = os.stat(path)
+        return [stat_info.st_size, stat_info.st_mtime_ns]
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+class Manifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.files = {}
+        self.aggregates = {}
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.aggregates = data.get("aggregates", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable manifest {self.path}: {str(e)}")
+
+    def save(self):
+        if not self.dirty:
+            return
+        write_file_atomic(self.path, json.dumps({"files": self.files, "aggregates": self.aggregates}, separators=(',', ':')).encode('utf-8'))
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def checkpoint(self, interval=MANIFEST_SAVE_SECONDS):
+        # Called as results arrive, so a crash mid-run keeps what was already finished
+        if time.monotonic() - self.last_save >= interval:
+            self.save()
+
+    def _key(self, path):
+        return os.path.relpath(os.fspath(path), self.directory)
+
+    def is_current(self, path, action, params_hash, stat_info=None):
+        entry = self.files.get(self._key(path))
+        if entry is None or entry.get("actions", {}).get(action) != params_hash:
+            return False
+        try:
+            stat_info = stat_info or get_stat(path)
+        except OSError:
+            return False
+        return entry["size"] == stat_info.st_size and entry["mtime"] == stat_info.st_mtime_ns
+
+    def _entry(self, path, stat_info):
+        key = self._key(path)
+        entry = self.files.get(key)
+        if entry is None or entry["size"] != stat_info.st_size or entry["mtime"] != stat_info.st_mtime_ns:
+            # The file changed, so results (and hashes) recorded for it no longer apply
+            entry = {"size": stat_info.st_size, "mtime": stat_info.st_mtime_ns, "actions": {}}
+            self.files[key] = entry
+        return entry
+
+    def record(self, path, action, params_hash, stat_info=None):
+        entry = self._entry(path, stat_info or get_stat(path))
+        entry["actions"][action] = params_hash
+        self.dirty = True
+
+    def get_hash(self, path, algorithm, stat_info=None):
+        entry = self.files.get(self._key(path))
+        if entry is None:
+            return None
+        stat_info = stat_info or get_stat(path)
+        if entry["size"] != stat_info.st_size or entry["mtime"] != stat_info.st_mtime_ns:
+            return None
+        return entry.get("hashes", {}).get(algorithm)
+
+    def record_hash(self, path, algorithm, digest, stat_info=None):
+        entry = self._entry(path, stat_info or get_stat(path))
+        entry.setdefault("hashes", {})[algorithm] = digest
+        self.dirty = True
+
+    def filter_changed(self, files, action, params_hash, outputs_for=None):
+        # Returns {path: stat} for files that are new, modified, processed with other parameters or missing any of their outputs
+        changed = {}
+        for file in files:
+            path = os.fspath(file)
+            try:
+                stat_info = get_stat(file)
+            except OSError as e:
+                logging.error(f"Error getting metadata for {path}: {str(e)}")
+                continue
+            if self.is_current(path, action, params_hash, stat_info) and (outputs_for is None or all(os.path.exists(output) for output in outputs_for(path))):
+                continue
+            changed[path] = stat_info
+        return changed
+
+    def inputs_digest(self, files, params_hash):
+        digest = hashlib.sha256(params_hash.encode('utf-8'))
+        for file in sorted(files, key=os.fspath):
+            stat_info = get_stat(file)
+            digest.update(f"{self._key(file)}|{stat_info.st_size}|{stat_info.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_aggregate_current(self, action, digest, outputs=()):
+        return self.aggregates.get(action) == digest and all(os.path.exists(output) for output in outputs)
+
+    def record_aggregate(self, action, digest):
+        self.aggregates[action] = digest
+        self.dirty = True
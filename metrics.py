@@ -0,0 +1,133 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+METRIC_PREFIX = "file_processor"
+
+
+class Metrics:
+    # Per-stage timers and per-action counters. Cheap enough to stay on in the hot path:
+    # one perf_counter pair and a locked dict update per measurement.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage, seconds, calls=1):
+        with self.lock:
+            timer = self.timers.setdefault(stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timer["calls"] += calls
+            timer["seconds"] += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def count(self, action, name, value=1):
+        with self.lock:
+            counters = self.counters.setdefault(action, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timers": {stage: dict(timer) for stage, timer in self.timers.items()},
+                "counters": {action: dict(counters) for action, counters in self.counters.items()}
+            }
+
+    def drain(self):
+        # Used by worker processes to ship their measurements back with each chunk of results
+        with self.lock:
+            snapshot = {"timers": self.timers, "counters": self.counters}
+            self.timers = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self.lock:
+            for stage, other in snapshot.get("timers", {}).items():
+                timer = self.timers.setdefault(stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+                timer["calls"] += other["calls"]
+                timer["seconds"] += other["seconds"]
+                timer["max_seconds"] = max(timer["max_seconds"], other["max_seconds"])
+            for action, other in snapshot.get("counters", {}).items():
+                counters = self.counters.setdefault(action, {})
+                for name, value in other.items():
+                    counters[name] = counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+
+METRICS = Metrics()
+
+def timer(stage):
+    return METRICS.timer(stage)
+
+def count(action, name, value=1):
+    METRICS.count(action, name, value)
+
+def export_metrics(path, output_format=None, labels=None):
+    # .prom files are rewritten atomically for the node_exporter textfile collector,
+    # everything else gets one JSON line appended per run
+    output_format = output_format or ("prometheus" if path.endswith(".prom") else "jsonl")
+    snapshot = METRICS.snapshot()
+    try:
+        if output_format == "prometheus":
+            from file_utils import write_file_atomic  # file_utils imports this module
+            write_file_atomic(path, format_prometheus(snapshot, labels or {}).encode('utf-8'))
+        else:
+            with open(path, 'a') as f:
+                f.write(json.dumps({"timestamp": datetime.now().isoformat(timespec="seconds"), "labels": labels or {}, **snapshot}) + "\n")
+    except OSError as e:
+        logging.error(f"Error exporting metrics to {path}: {str(e)}")
+
+def format_prometheus(snapshot, labels):
+    def label_text(extra):
+        merged = {**labels, **extra}
+        return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in sorted(merged.items())) + "}"
+
+    lines = []
+    stage_metrics = [
+        ("stage_calls_total", "counter", "calls", "Number of times each stage ran"),
+        ("stage_seconds_total", "counter", "seconds", "Total seconds spent in each stage"),
+        ("stage_seconds_max", "gauge", "max_seconds", "Slowest single run of each stage")
+    ]
+    for name, metric_type, key, help_text in stage_metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+        for stage, timer in sorted(snapshot["timers"].items()):
+            lines.append(f"{METRIC_PREFIX}_{name}{label_text({'stage': stage})} {timer[key]}")
+
+    counter_names = sorted({name for counters in snapshot["counters"].values() for name in counters})
+    for name in counter_names:
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        for action, counters in sorted(snapshot["counters"].items()):
+            if name in counters:
+                lines.append(f"{METRIC_PREFIX}_{name}_total{label_text({'action': action})} {counters[name]}")
+    return "\n".join(lines) + "\n"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def profile_call(func, output_path, *args, **kwargs):
+    # Optional cProfile hook; the stats file can be opened with pstats or snakeviz
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(output_path)
+        logging.info(f"Profile written to {output_path}")
@@ -4,8 +4,27 @@ from config import (
     DEFAULT_WATERMARK_POSITION,
     DEFAULT_FONT_SIZE,
     DEFAULT_SOFT_EDGE,
+    DEFAULT_SOFT_EDGE_WIDTH,
+    DEFAULT_SOFT_EDGE_FALLOFF,
     DEFAULT_INCLUDE_DATE,
-    DEFAULT_SAME_POSITION
+    DEFAULT_SAME_POSITION,
+    DEFAULT_WORKERS,
+    DEFAULT_MERGE_STREAMING,
+    DEFAULT_MAX_TILE_SIZE,
+    DEFAULT_INCREMENTAL,
+    DEFAULT_RESUME,
+    DEFAULT_RETRY_FAILED,
+    DEFAULT_METADATA_FORMAT,
+    DEFAULT_METADATA_WORKERS,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_PDF_MAX_PART_SIZE,
+    DEFAULT_PIPELINE,
+    DEFAULT_PIPELINE_IN_FLIGHT,
+    DEFAULT_PROFILE_DRAFT,
+    DEFAULT_ENCODER_PRESET,
+    DEFAULT_KEEP_METADATA,
+    DEFAULT_DEDUP,
+    DEFAULT_MERGE_DEDUP
 )
 
 class ActionOption:
@@ -27,14 +46,35 @@ actions = [
     ActionOption("✨", "Merge files", "actions.merge", "merge_files", "Merge all files in the directory", [
         {"type": "confirm", "name": "include_subdirectories", "message": "🔍 Include subdirectories?", "default": True},
         {"type": "input", "name": "matrix", "message": "🔢 Enter the matrix for merging images (rows,cols):", "default": "1,1"},
-        {"type": "list", "name": "fill_method", "message": "🖼️ Choose how to handle the last row:", "choices": ["stretch", "leave", "repeat"], "default": "stretch"}
+        {"type": "list", "name": "fill_method", "message": "🖼️ Choose how to handle the last row:", "choices": ["stretch", "leave", "repeat"], "default": "stretch"},
+        {"type": "confirm", "name": "incremental", "message": "⏭️ Skip files that are unchanged since the last run?", "default": DEFAULT_INCREMENTAL},
+        {"type": "confirm", "name": "additional_params", "message": "⚙️ Would you like to specify additional parameters for the merge?", "default": False},
+        {"type": "confirm", "name": "streaming", "message": "🧵 Stream the merged image band by band (saves a PNG, uses little memory)?", "default": DEFAULT_MERGE_STREAMING, "condition": "additional_params"},
+        {"type": "input", "name": "max_tile_size", "message": f"📐 Enter the maximum tile size in pixels (0 keeps full resolution, default is {str(DEFAULT_MAX_TILE_SIZE)}):", "default": str(DEFAULT_MAX_TILE_SIZE), "condition": "additional_params"},
+        {"type": "list", "name": "encoder_preset", "message": "🗜️ Choose the encoder preset for the merged image (speed vs. file size):", "choices": ["fast", "balanced", "small"], "default": DEFAULT_ENCODER_PRESET, "condition": "additional_params"},
+        {"type": "confirm", "name": "pipeline", "message": "🚰 Read and decode tiles ahead while the merged image is written?", "default": DEFAULT_PIPELINE, "condition": "additional_params"},
+        {"type": "input", "name": "in_flight", "message": f"🚰 Enter the maximum number of tiles in flight (default is {str(DEFAULT_PIPELINE_IN_FLIGHT)}):", "default": str(DEFAULT_PIPELINE_IN_FLIGHT), "condition": "additional_params and pipeline"},
+        {"type": "confirm", "name": "dedup", "message": "👯 Merge identical files only once?", "default": DEFAULT_MERGE_DEDUP, "condition": "additional_params"},
+        {"type": "input", "name": "page_ranges", "message": "📑 Enter PDF page ranges per file, e.g. a.pdf:1-3;b.pdf:5- (leave blank for all pages):", "default": "", "condition": "additional_params"},
+        {"type": "input", "name": "max_part_size", "message": f"✂️ Enter the maximum size of each merged PDF part in MB (0 writes one file, default is {str(DEFAULT_PDF_MAX_PART_SIZE)}):", "default": str(DEFAULT_PDF_MAX_PART_SIZE), "condition": "additional_params"}
     ]),
     ActionOption("📋", "Copy metadata", "actions.metadata", "copy_metadata", "Copy metadata of all files in the directory", [
-        {"type": "confirm", "name": "include_subdirectories", "message": "🔍 Include subdirectories?", "default": True}
+        {"type": "confirm", "name": "include_subdirectories", "message": "🔍 Include subdirectories?", "default": True},
+        {"type": "confirm", "name": "additional_params", "message": "⚙️ Would you like to specify additional parameters for the metadata export?", "default": False},
+        {"type": "list", "name": "output_format", "message": "🗂️ Choose the metadata output format:", "choices": ["json", "ndjson", "csv", "parquet"], "default": DEFAULT_METADATA_FORMAT, "condition": "additional_params"},
+        {"type": "confirm", "name": "include_hash", "message": "#️⃣ Include a content hash of every file?", "default": False, "condition": "additional_params"},
+        {"type": "list", "name": "hash_algorithm", "message": "#️⃣ Choose the hash algorithm:", "choices": ["sha256", "xxhash", "md5"], "default": DEFAULT_HASH_ALGORITHM, "condition": "additional_params and include_hash"},
+        {"type": "confirm", "name": "include_media_info", "message": "🖼️ Include image dimensions and PDF page counts?", "default": False, "condition": "additional_params"},
+        {"type": "input", "name": "workers", "message": f"⚡ Enter the number of threads reading metadata (default is {str(DEFAULT_METADATA_WORKERS)}):", "default": str(DEFAULT_METADATA_WORKERS), "condition": "additional_params"},
+        {"type": "confirm", "name": "incremental", "message": "⏭️ Skip files that are unchanged since the last run?", "default": DEFAULT_INCREMENTAL, "condition": "additional_params"}
     ]),
     ActionOption("🌊", "Apply watermark", "actions.watermark", "apply_watermark_to_files", "Apply watermark to files in the directory", [
         {"type": "input", "name": "watermark", "message": "🌊 Enter the watermark file path (leave blank for text only):", "default": ""},
         {"type": "confirm", "name": "additional_params", "message": "⚙️ Would you like to specify additional parameters for the watermark?", "default": False},
+        {"type": "confirm", "name": "incremental", "message": "⏭️ Skip files that are unchanged since the last run?", "default": DEFAULT_INCREMENTAL, "condition": "additional_params"},
+        {"type": "confirm", "name": "resume", "message": "⏯️ Resume the last run, skipping files it already finished?", "default": DEFAULT_RESUME, "condition": "additional_params"},
+        {"type": "confirm", "name": "retry_failed", "message": "🔁 Only retry the files that failed in the last run?", "default": DEFAULT_RETRY_FAILED, "condition": "additional_params and not resume"},
+        {"type": "confirm", "name": "dedup", "message": "👯 Watermark identical files once and link the other copies?", "default": DEFAULT_DEDUP, "condition": "additional_params"},
         {"type": "input", "name": "text", "message": "📝 Enter the text for watermark (leave blank if not applicable):", "default": "", "condition": "additional_params"},
         {"type": "confirm", "name": "include_date", "message": "📅 Include the current date in the watermark?", "default": DEFAULT_INCLUDE_DATE, "condition": "additional_params"},
         {"type": "list", "name": "image_position", "message": "📍 Select the position for the image watermark:", "choices": ["top_left", "top_center", "top_right", "middle_left", "middle_center", "middle_right", "bottom_left", "bottom_center", "bottom_right"], "default": DEFAULT_WATERMARK_POSITION, "condition": "additional_params"},
@@ -43,7 +83,23 @@ actions = [
         {"type": "input", "name": "size", "message": f"🔍 Enter the size of the watermark as a percentage of the image size (default is { str(DEFAULT_WATERMARK_SIZE)}%):", "default": str(DEFAULT_WATERMARK_SIZE), "condition": "additional_params"},
         {"type": "input", "name": "transparency", "message": f"💧 Enter the transparency level for the watermark (0-255, default is {str(DEFAULT_WATERMARK_TRANSPARENCY)}):", "default": str(DEFAULT_WATERMARK_TRANSPARENCY), "condition": "additional_params"},
         {"type": "confirm", "name": "soft_edge", "message": f"🌫️ Apply soft edges to the watermark image?", "default": DEFAULT_SOFT_EDGE, "condition": "additional_params"},
+        {"type": "input", "name": "soft_edge_width", "message": f"🌫️ Enter the soft edge feather width in pixels (default is {str(DEFAULT_SOFT_EDGE_WIDTH)}):", "default": str(DEFAULT_SOFT_EDGE_WIDTH), "condition": "additional_params and soft_edge"},
+        {"type": "list", "name": "soft_edge_falloff", "message": "🌫️ Choose the soft edge falloff curve:", "choices": ["linear", "ease_in", "ease_out", "smooth"], "default": DEFAULT_SOFT_EDGE_FALLOFF, "condition": "additional_params and soft_edge"},
         {"type": "input", "name": "font_size", "message": f"🔤 Enter the font size for the text watermark (default is {str(DEFAULT_FONT_SIZE)}):", "default": str(DEFAULT_FONT_SIZE), "condition": "additional_params and text"},
+        {"type": "input", "name": "workers", "message": f"⚡ Enter the number of parallel workers (0 uses every core, default is {str(DEFAULT_WORKERS)}):", "default": str(DEFAULT_WORKERS), "condition": "additional_params"},
+        {"type": "list", "name": "encoder_preset", "message": "🗜️ Choose the encoder preset for the output images (speed vs. file size):", "choices": ["fast", "balanced", "small"], "default": DEFAULT_ENCODER_PRESET, "condition": "additional_params"},
+        {"type": "confirm", "name": "keep_metadata", "message": "🏷️ Copy EXIF and ICC profile data to the output images?", "default": DEFAULT_KEEP_METADATA, "condition": "additional_params"},
+        {"type": "confirm", "name": "pipeline", "message": "🚰 Overlap reading and writing files with watermarking (helps on network storage)?", "default": DEFAULT_PIPELINE, "condition": "additional_params"},
+        {"type": "input", "name": "in_flight", "message": f"🚰 Enter the maximum number of files in flight (default is {str(DEFAULT_PIPELINE_IN_FLIGHT)}):", "default": str(DEFAULT_PIPELINE_IN_FLIGHT), "condition": "additional_params and pipeline"},
+    ]),
+    ActionOption("🎛️", "Apply watermark profiles", "actions.profiles", "apply_watermark_profiles", "Write several watermarked variants of every image from a single decode", [
+        {"type": "input", "name": "profiles_file", "message": "🎛️ Enter the path of the profiles file (JSON or YAML):", "default": ""},
+        {"type": "confirm", "name": "include_subdirectories", "message": "🔍 Include subdirectories?", "default": True},
+        {"type": "confirm", "name": "draft", "message": "⚡ Decode JPEGs at reduced size when every output is smaller?", "default": DEFAULT_PROFILE_DRAFT},
+        {"type": "input", "name": "workers", "message": f"⚡ Enter the number of parallel workers (0 uses every core, default is {str(DEFAULT_WORKERS)}):", "default": str(DEFAULT_WORKERS)},
+        {"type": "confirm", "name": "incremental", "message": "⏭️ Skip files that are unchanged since the last run?", "default": DEFAULT_INCREMENTAL},
+        {"type": "confirm", "name": "resume", "message": "⏯️ Resume the last run, skipping files it already finished?", "default": DEFAULT_RESUME},
+        {"type": "confirm", "name": "retry_failed", "message": "🔁 Only retry the files that failed in the last run?", "default": DEFAULT_RETRY_FAILED, "condition": "not resume"}
     ]),
     ActionOption("🔄", "Load last request", None, None, "Load and adjust the last request", []),
     ActionOption("❌", "Quit", None, None, "Quit the application", [])
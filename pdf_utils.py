@@ -0,0 +1,268 @@
+import os
+import hashlib
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject
+)
+
+
+def parse_page_ranges(page_ranges, page_count):
+    # "1-3,5,8-" -> [0, 1, 2, 4, 7, ..., page_count - 1]; 1-based and inclusive like print dialogs
+    if not page_ranges or not page_ranges.strip():
+        return list(range(page_count))
+    pages = []
+    for part in page_ranges.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start = int(start) if start.strip() else 1
+            end = int(end) if end.strip() else page_count
+        else:
+            start = end = int(part)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part}")
+        pages.extend(range(start - 1, min(end, page_count)))
+    return pages
+
+def parse_page_range_map(page_ranges):
+    # "a.pdf:1-3;b.pdf:5-" -> {"a.pdf": "1-3", "b.pdf": "5-"}
+    if isinstance(page_ranges, dict):
+        return page_ranges
+    mapping = {}
+    for item in (page_ranges or "").split(';'):
+        if ':' in item:
+            name, ranges = item.rsplit(':', 1)
+            mapping[name.strip()] = ranges.strip()
+    return mapping
+
+
+class StreamingPdfWriter(PdfWriter):
+    # Writes every cloned object to disk as soon as a page has been added and keeps only a placeholder
+    # in memory, so merging thousands of documents needs memory for one page at a time.
+    # The page tree, info and catalog objects are kept and written when the writer is closed.
+    def __init__(self, path, dedup_resources=True):
+        super().__init__()
+        self.path = path
+        self.dedup_resources = dedup_resources
+        # Later inputs may have a newer header than the first one, so announce the newest version upfront
+        self.pdf_header = b"%PDF-1.7"
+        self.stream = open(path, 'wb')
+        self.stream.write(self.pdf_header + b"\n%\xE2\xE3\xCF\xD3\n")
+        self.positions = {}
+        self.flushed = 0
+        self.reserved = {self._pages.idnum, self._info.idnum, self._root.idnum}
+        self.stream_hashes = {}
+        self.redirects = {}
+        self.deduplicated = 0
+
+    def tell(self):
+        return self.stream.tell()
+
+    def add_page_from(self, reader, page_index):
+        self.add_page(reader.pages[page_index])
+        self.flush()
+
+    def forget_reader(self, reader):
+        # id() values are reused after a reader is collected, so its translation table must not outlive it
+        self._id_translated.pop(id(reader), None)
+
+    def flush(self):
+        start = self.flushed
+        end = len(self._objects)
+        batch = [idnum for idnum in range(start + 1, end + 1) if idnum not in self.reserved]
+        if self.dedup_resources:
+            self._find_duplicates(batch)
+        for idnum in batch:
+            obj = self._objects[idnum - 1]
+            self._redirect_references(obj)
+            self.positions[idnum] = self.stream.tell()
+            self.stream.write(f"{idnum} 0 obj\n".encode())
+            if obj is None or idnum in self.redirects:
+                NullObject().write_to_stream(self.stream, None)
+            else:
+                obj.write_to_stream(self.stream, None)
+            self.stream.write(b"\nendobj\n")
+            # Keep a tiny stand-in so later clones of the same source object still resolve to this id
+            placeholder = NullObject()
+            placeholder.indirect_reference = IndirectObject(self.redirects.get(idnum, idnum), 0, self)
+            self._objects[idnum - 1] = placeholder
+        self.flushed = end
+
+    def _find_duplicates(self, batch):
+        # Identical streams (fonts, images, ICC profiles) are written once. Keys include the stream
+        # dictionary with references already redirected, so repeating the pass catches nested duplicates.
+        for _ in range(3):
+            found = False
+            for idnum in batch:
+                obj = self._objects[idnum - 1]
+                if idnum in self.redirects or not isinstance(obj, StreamObject):
+                    continue
+                key = self._stream_key(obj)
+                canonical = self.stream_hashes.setdefault(key, idnum)
+                if canonical != idnum:
+                    self.redirects[idnum] = canonical
+                    self.deduplicated += 1
+                    found = True
+            if not found:
+                break
+
+    def _stream_key(self, obj):
+        digest = hashlib.sha256(obj._data)
+        for key in sorted(obj.keys()):
+            value = obj[key]
+            if isinstance(value, IndirectObject):
+                value = f"ref:{self.redirects.get(value.idnum, value.idnum)}"
+            digest.update(f"{key}={value};".encode('utf-8', 'replace'))
+        return digest.digest()
+
+    def _redirect_references(self, obj):
+        if not self.redirects:
+            return
+        if isinstance(obj, DictionaryObject):
+            items = obj.items()
+        elif isinstance(obj, ArrayObject):
+            items = enumerate(obj)
+        else:
+            return
+        for key, value in list(items):
+            if isinstance(value, IndirectObject):
+                if value.pdf is self and value.idnum in self.redirects:
+                    obj[key] = IndirectObject(self.redirects[value.idnum], 0, self)
+            else:
+                self._redirect_references(value)
+
+    def close(self):
+        for idnum in sorted(self.reserved):
+            obj = self._objects[idnum - 1]
+            self.positions[idnum] = self.stream.tell()
+            self.stream.write(f"{idnum} 0 obj\n".encode())
+            obj.write_to_stream(self.stream, None)
+            self.stream.write(b"\nendobj\n")
+        xref_location = self.stream.tell()
+        size = len(self._objects) + 1
+        self.stream.write(f"xref\n0 {size}\n".encode())
+        self.stream.write(f"{0:0>10} {65535:0>5} f \n".encode())
+        for idnum in range(1, size):
+            self.stream.write(f"{self.positions[idnum]:0>10} {0:0>5} n \n".encode())
+        self.stream.write(f"trailer\n<< /Size {size} /Root {self._root.idnum} 0 R /Info {self._info.idnum} 0 R >>".encode())
+        self.stream.write(f"\nstartxref\n{xref_location}\n%%EOF\n".encode())
+        self.stream.close()
+
+    def abort(self):
+        # Never leave a half-written PDF behind
+        self.stream.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_pdf(path):
+    # Passing an open file keeps PdfReader from reading the whole document into memory
+    handle = open(path, 'rb')
+    try:
+        return handle, PdfReader(handle)
+    except Exception:
+        handle.close()
+        raise
+
+def add_image_xobject(writer, width, height, rgb_data, alpha_data):
+    # Both data arguments are zlib-compressed 8-bit samples; the alpha channel becomes a soft mask
+    smask = EncodedStreamObject()
+    smask.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(width),
+        NameObject("/Height"): NumberObject(height),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode")
+    })
+    smask._data = alpha_data
+    image = EncodedStreamObject()
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(width),
+        NameObject("/Height"): NumberObject(height),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+        NameObject("/SMask"): writer._add_object(smask)
+    })
+    image._data = rgb_data
+    return writer._add_object(image)
+
+def add_content_stream(writer, content):
+    stream = DecodedStreamObject()
+    stream.set_data(content.encode('latin-1'))
+    return writer._add_object(stream)
+
+def add_stamp_overlay(writer, box, images, name="/FPWatermark"):
+    # Builds one Form XObject holding every stamp image for a page box, plus the two tiny content
+    # streams that isolate the page's own graphics state and then draw the form.
+    # images: [(width_px, height_px, rgb_data, alpha_data, (x, y, width, height) in points)]
+    left, bottom, width, height = box
+    xobjects = DictionaryObject()
+    content = []
+    for index, (image_width, image_height, rgb_data, alpha_data, placement) in enumerate(images):
+        image_name = f"/Im{index}"
+        xobjects[NameObject(image_name)] = add_image_xobject(writer, image_width, image_height, rgb_data, alpha_data)
+        x, y, placed_width, placed_height = placement
+        content.append(f"q {placed_width:.4f} 0 0 {placed_height:.4f} {x:.4f} {y:.4f} cm {image_name} Do Q")
+    form = DecodedStreamObject()
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)]),
+        NameObject("/Resources"): DictionaryObject({NameObject("/XObject"): xobjects})
+    })
+    form.set_data("\n".join(content).encode('latin-1'))
+    form_ref = writer._add_object(form)
+    before = add_content_stream(writer, "q\n")
+    after = add_content_stream(writer, f"\nQ q 1 0 0 1 {left:.4f} {bottom:.4f} cm {name} Do Q\n")
+    return name, form_ref, before, after
+
+def detach_resources(page):
+    # Gives a page its own copy of /Resources, its /XObject dictionary and a /Contents array. These are
+    # often shared between pages, and a StreamingPdfWriter has flushed them (leaving only a placeholder)
+    # by the time a later page is stamped, so call this on the source page before it is added.
+    resources = page.get("/Resources")
+    resources = DictionaryObject(resources.get_object()) if resources is not None else DictionaryObject()
+    xobjects = resources.get("/XObject")
+    if xobjects is not None:
+        resources[NameObject("/XObject")] = DictionaryObject(xobjects.get_object())
+    page[NameObject("/Resources")] = resources
+    contents = page.get("/Contents")
+    if contents is not None and isinstance(contents.get_object(), ArrayObject):
+        page[NameObject("/Contents")] = ArrayObject(contents.get_object())
+    return page
+
+def stamp_page(page, overlay):
+    # Appends the overlay without parsing or re-encoding the page's existing content streams
+    name, form_ref, before, after = overlay
+    detach_resources(page)
+    resources = page["/Resources"]
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        xobjects = resources[NameObject("/XObject")] = DictionaryObject()
+    xobjects[NameObject(name)] = form_ref
+
+    contents = ArrayObject([before])
+    existing = page.get("/Contents")
+    if existing is not None:
+        if isinstance(existing, ArrayObject):
+            contents.extend(existing)
+        else:
+            contents.append(existing)
+    contents.append(after)
+    page[NameObject("/Contents")] = contents
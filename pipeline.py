@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from executor import FileResult, resolve_workers, init_worker_process
+from metrics import METRICS
+from config import (
+    DEFAULT_WORKERS,
+    DEFAULT_PIPELINE_IN_FLIGHT,
+    DEFAULT_PIPELINE_QUEUE_SIZE,
+    DEFAULT_PIPELINE_IO_WORKERS
+)
+
+_DONE = object()
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _compute_with_metrics(compute, item, data):
+    return compute(item, data), METRICS.drain()
+
+def run_pipeline(items, read, compute, write, workers=DEFAULT_WORKERS, in_flight=DEFAULT_PIPELINE_IN_FLIGHT, queue_size=DEFAULT_PIPELINE_QUEUE_SIZE, io_workers=DEFAULT_PIPELINE_IO_WORKERS, ordered=False, use_processes=False, initializer=None, initargs=(), on_result=None):
+    # Every item goes through read(item) -> compute(item, data) -> write(item, result).
+    # Reads and writes run on an I/O thread pool, compute on its own pool, so disk and network waits
+    # overlap with CPU work. Bounded queues and the in-flight limit keep memory proportional to
+    # in_flight files. With ordered=True, write() is called in input order by a single writer.
+    # on_result(result) is called on the event loop as soon as each item is finished.
+    return asyncio.run(_run_pipeline(items, read, compute, write, resolve_workers(workers), max(1, in_flight), max(1, queue_size), max(1, io_workers), ordered, use_processes, initializer, initargs, on_result))
+
+async def _run_pipeline(items, read, compute, write, workers, in_flight, queue_size, io_workers, ordered, use_processes, initializer, initargs, on_result=None):
+    loop = asyncio.get_running_loop()
+    read_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(queue_size)
+    slots = asyncio.Semaphore(in_flight)
+    iterator = enumerate(items)
+    results = []
+
+    pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    if use_processes:
+        initializer, initargs = init_worker_process, (initializer, initargs)
+    compute_pool = pool_class(max_workers=workers, initializer=initializer, initargs=initargs)
+    io_pool = ThreadPoolExecutor(max_workers=io_workers)
+
+    async def reader():
+        # Readers share one iterator, so discovery can still be lazy
+        for index, item in iterator:
+            await slots.acquire()
+            try:
+                data = await loop.run_in_executor(io_pool, read, item)
+                await read_queue.put((index, item, data, None))
+            except Exception as e:
+                await read_queue.put((index, item, None, e))
+
+    async def computer():
+        while True:
+            entry = await read_queue.get()
+            if entry is _DONE:
+                return
+            index, item, data, error = entry
+            result = None
+            if error is None:
+                try:
+                    if use_processes:
+                        # Timers recorded in worker processes are merged back into this process
+                        result, snapshot = await loop.run_in_executor(compute_pool, _compute_with_metrics, compute, item, data)
+                        METRICS.merge(snapshot)
+                    else:
+                        result = await loop.run_in_executor(compute_pool, compute, item, data)
+                except Exception as e:
+                    error = e
+            await write_queue.put((index, item, result, error))
+
+    async def finish(item, result, error):
+        if error is None:
+            try:
+                value = await loop.run_in_executor(io_pool, write, item, result)
+                file_result = value if isinstance(value, FileResult) else FileResult(item, True, value=value)
+            except Exception as e:
+                file_result = FileResult(item, False, error=str(e))
+        else:
+            file_result = FileResult(item, False, error=str(error))
+        results.append(file_result)
+        if on_result:
+            on_result(file_result)
+        slots.release()
+
+    async def writer():
+        waiting = {}
+        next_index = 0
+        while True:
+            entry = await write_queue.get()
+            if entry is _DONE:
+                return
+            index, item, result, error = entry
+            if not ordered:
+                await finish(item, result, error)
+                continue
+            # Results that overtook a slower file wait here; the in-flight limit bounds how many
+            waiting[index] = (item, result, error)
+            while next_index in waiting:
+                await finish(*waiting.pop(next_index))
+                next_index += 1
+
+    try:
+        writers = [asyncio.create_task(writer()) for _ in range(1 if ordered else io_workers)]
+        computers = [asyncio.create_task(computer()) for _ in range(workers)]
+        await asyncio.gather(*[reader() for _ in range(io_workers)])
+        for _ in computers:
+            await read_queue.put(_DONE)
+        await asyncio.gather(*computers)
+        for _ in writers:
+            await write_queue.put(_DONE)
+        await asyncio.gather(*writers)
+    finally:
+        compute_pool.shutdown()
+        io_pool.shutdown()
+    return results
@@ -0,0 +1,52 @@
+import os
+import sys
+import pytest
+from PIL import Image
+
+# The modules live at the top of the repository, so make them importable from here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_pdf(path, pages=3, shared_resources=True, size=(200, 100)):
+    # A small hand-written PDF. With shared_resources every page points at one indirect /Resources
+    # dictionary (and one indirect /XObject dictionary), as most generators write them.
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: ("<< /Type /Pages /Kids [" + " ".join(f"{10 + i} 0 R" for i in range(pages)) + f"] /Count {pages} >>").encode(),
+        5: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        6: b"<< /Font << /F1 5 0 R >> /XObject 7 0 R >>",
+        7: b"<< /Fx 8 0 R >>"
+    }
+    form = b"0 0 1 rg 0 0 10 10 re f"
+    objects[8] = b"<< /Type /XObject /Subtype /Form /BBox [0 0 10 10] /Length %d >>\nstream\n%s\nendstream" % (len(form), form)
+    for i in range(pages):
+        content = f"BT /F1 12 Tf 10 10 Td (page {i + 1}) Tj ET /Fx Do".encode()
+        objects[20 + i] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        resources = "6 0 R" if shared_resources else "<< /Font << /F1 5 0 R >> /XObject << /Fx 8 0 R >> >>"
+        objects[10 + i] = f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {size[0]} {size[1]}] /Resources {resources} /Contents {20 + i} 0 R >>".encode()
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for idnum in sorted(objects):
+        offsets[idnum] = len(data)
+        data += b"%d 0 obj\n%s\nendobj\n" % (idnum, objects[idnum])
+    xref = len(data)
+    object_count = max(objects) + 1
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % object_count
+    for idnum in range(1, object_count):
+        data += b"%010d 00000 n \n" % offsets[idnum] if idnum in offsets else b"0000000000 65535 f \n"
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (object_count, xref)
+    with open(path, 'wb') as f:
+        f.write(bytes(data))
+    return str(path)
+
+def write_image(path, size=(60, 40), color=(200, 30, 30)):
+    Image.new('RGB', size, color).save(path)
+    return str(path)
+
+
+@pytest.fixture
+def watermark_file(tmp_path):
+    path = tmp_path / "logo.png"
+    Image.new('RGBA', (20, 20), (0, 0, 255, 255)).save(path)
+    return str(path)
@@ -0,0 +1,91 @@
+import os
+import shutil
+from executor import FileResult
+from manifest import Manifest
+from conftest import write_image
+from dedup import find_duplicates, run_deduplicated, link_or_copy
+from actions.watermark import apply_watermark_to_files, get_watermark_output_path
+
+
+def write_file(path, content):
+    path.write_text(content)
+    return str(path)
+
+def output_for(path):
+    return path + ".out"
+
+class FakeRun:
+    # Writes an output for every file it is given, failing the ones in `failing`
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.seen = []
+
+    def __call__(self, files, on_result=None):
+        results = []
+        for path in files:
+            self.seen.append(path)
+            if os.path.basename(path) in self.failing:
+                result = FileResult(path, False, "boom")
+            else:
+                with open(output_for(path), 'w') as f:
+                    f.write("out:" + path)
+                result = FileResult(path, True)
+            on_result(result)
+            results.append(result)
+        return results
+
+def test_find_duplicates_groups_identical_content(tmp_path):
+    a = write_file(tmp_path / "a.txt", "same")
+    b = write_file(tmp_path / "b.txt", "same")
+    c = write_file(tmp_path / "c.txt", "diff")
+    # Same bytes with another extension are left alone
+    d = write_file(tmp_path / "d.dat", "same")
+    unique, duplicates = find_duplicates([a, b, c, d])
+    assert unique == [a, c, d]
+    assert duplicates == {a: [b]}
+
+def test_hashes_are_cached_in_the_manifest(tmp_path):
+    a = write_file(tmp_path / "a.txt", "same")
+    b = write_file(tmp_path / "b.txt", "same")
+    manifest = Manifest(str(tmp_path))
+    find_duplicates([a, b], manifest, "sha256")
+    assert manifest.get_hash(a, "sha256") == manifest.get_hash(b, "sha256") is not None
+
+def test_duplicates_get_a_linked_output(tmp_path):
+    a = write_file(tmp_path / "a.txt", "same")
+    b = write_file(tmp_path / "b.txt", "same")
+    run = FakeRun()
+    reported = []
+    results = run_deduplicated(run, [a, b], output_for, on_result=reported.append)
+
+    assert run.seen == [a]
+    assert [(result.path, result.success) for result in results] == [(a, True), (b, True)]
+    assert [result.path for result in reported] == [a, b]
+    assert os.path.samefile(output_for(a), output_for(b))
+
+def test_duplicates_share_a_failure(tmp_path):
+    a = write_file(tmp_path / "a.txt", "same")
+    b = write_file(tmp_path / "b.txt", "same")
+    results = run_deduplicated(FakeRun(failing={"a.txt"}), [a, b], output_for, on_result=lambda result: None)
+    assert [(result.path, result.success, result.error) for result in results] == [(a, False, "boom"), (b, False, "boom")]
+    assert not os.path.exists(output_for(b))
+
+def test_link_replaces_an_existing_output(tmp_path):
+    source = write_file(tmp_path / "source.out", "new")
+    target = write_file(tmp_path / "target.out", "old")
+    link_or_copy(source, target)
+    with open(target) as f:
+        assert f.read() == "new"
+    assert sorted(os.listdir(tmp_path)) == ["source.out", "target.out"]
+
+def test_watermark_dedup_links_identical_images(tmp_path, watermark_file):
+    directory = tmp_path / "photos"
+    directory.mkdir()
+    original = write_image(directory / "a.jpg")
+    copy = str(directory / "b.jpg")
+    shutil.copy(original, copy)
+    other = write_image(directory / "c.jpg", color=(10, 200, 10))
+
+    assert apply_watermark_to_files(str(directory), watermark_file, workers=1, incremental=False, dedup=True) == (True, False)
+    assert os.path.samefile(get_watermark_output_path(original), get_watermark_output_path(copy))
+    assert not os.path.samefile(get_watermark_output_path(original), get_watermark_output_path(other))
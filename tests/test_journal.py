@@ -0,0 +1,143 @@
+import os
+import json
+from executor import FileResult
+from manifest import Manifest
+from journal import Journal, run_journaled, DONE, FAILED, SKIPPED
+from config import JOURNAL_FILENAME
+
+
+def make_files(directory, names):
+    paths = []
+    for name in names:
+        path = directory / name
+        path.write_text(name)
+        paths.append(str(path))
+    return paths
+
+def journal_lines(directory):
+    with open(directory / JOURNAL_FILENAME) as f:
+        return [json.loads(line) for line in f]
+
+class FakeRun:
+    # Stands in for an action's runner: fails the files in `failing` and remembers what it was given
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.seen = []
+
+    def __call__(self, files, on_result=None):
+        results = []
+        for path in files:
+            self.seen.append(path)
+            failed = os.path.basename(path) in self.failing
+            result = FileResult(path, not failed, "boom" if failed else None)
+            on_result(result)
+            results.append(result)
+        return results
+
+def test_outcomes_survive_reopening(tmp_path):
+    a, b, c = make_files(tmp_path, ["a", "b", "c"])
+    journal = Journal(str(tmp_path), "act", "run1")
+    journal.record(FileResult(a, True))
+    journal.record(FileResult(b, False, "boom"))
+    journal.record(FileResult(c, True, skipped=True))
+    journal.close()
+
+    reopened = Journal(str(tmp_path), "act", "run1")
+    assert [reopened.status(path) for path in (a, b, c)] == [DONE, FAILED, SKIPPED]
+    assert journal_lines(tmp_path)[1]["error"] == "boom"
+    # Other parameters or actions start from scratch
+    assert Journal(str(tmp_path), "act", "run2").status(a) is None
+    assert Journal(str(tmp_path), "other", "run1").status(a) is None
+
+def test_torn_last_line_is_ignored(tmp_path):
+    a, b = make_files(tmp_path, ["a", "b"])
+    journal = Journal(str(tmp_path), "act", "run1")
+    journal.record(FileResult(a, True))
+    journal.close()
+    with open(tmp_path / JOURNAL_FILENAME, 'a') as f:
+        f.write('{"run": "run1", "action": "act", "pa')
+    assert Journal(str(tmp_path), "act", "run1").status(a) == DONE
+
+def test_resume_and_retry_filters(tmp_path):
+    done, failed, skipped, new = make_files(tmp_path, ["done", "failed", "skipped", "new"])
+    journal = Journal(str(tmp_path), "act", "run1")
+    journal.record(FileResult(done, True))
+    journal.record(FileResult(failed, False))
+    journal.record(FileResult(skipped, True, skipped=True))
+    files = [done, failed, skipped, new]
+
+    assert journal.counts() == {DONE: 1, FAILED: 1, SKIPPED: 1}
+    assert list(journal.filter_files(files)) == files
+    assert list(journal.filter_files(files, resume=True)) == [failed, new]
+    assert list(journal.filter_files(files, retry_failed=True)) == [failed]
+    assert journal.finished(files) == [done, skipped]
+    journal.close()
+
+def test_compact_keeps_the_last_entry_per_file(tmp_path):
+    a, b = make_files(tmp_path, ["a", "b"])
+    journal = Journal(str(tmp_path), "act", "run1")
+    journal.record(FileResult(a, False))
+    journal.record(FileResult(a, True))
+    journal.record(FileResult(b, True))
+    journal.compact()
+
+    lines = journal_lines(tmp_path)
+    assert [(line["path"], line["status"]) for line in lines] == [("a", DONE), ("b", DONE)]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_interrupted_run_resumes_where_it_stopped(tmp_path):
+    files = make_files(tmp_path, ["a", "b", "c"])
+    first = FakeRun(failing={"b"})
+    results = run_journaled(first, files, Journal(str(tmp_path), "act", "run1"))
+    assert [result.success for result in results] == [True, False, True]
+    # A failure keeps the journal as it is
+    assert len(journal_lines(tmp_path)) == 3
+
+    resumed = FakeRun()
+    run_journaled(resumed, files, Journal(str(tmp_path), "act", "run1"), resume=True)
+    assert resumed.seen == [files[1]]
+
+    retried = FakeRun()
+    assert run_journaled(retried, files, Journal(str(tmp_path), "act", "run1"), retry_failed=True) == []
+    assert retried.seen == []
+
+def test_clean_run_compacts_the_journal(tmp_path):
+    files = make_files(tmp_path, ["a", "b"])
+    run_journaled(FakeRun(failing={"a"}), files, Journal(str(tmp_path), "act", "run1"))
+    run_journaled(FakeRun(), files, Journal(str(tmp_path), "act", "run1"), retry_failed=True)
+    assert sorted((line["path"], line["status"]) for line in journal_lines(tmp_path)) == [("a", DONE), ("b", DONE)]
+
+def test_incremental_run_records_successes_in_the_manifest(tmp_path):
+    files = make_files(tmp_path, ["a", "b", "c"])
+    manifest = Manifest(str(tmp_path))
+    run_journaled(FakeRun(failing={"b"}), files, Journal(str(tmp_path), "act", "run1"), manifest, incremental=True)
+
+    # Only the failed file is left for the next incremental run
+    second = FakeRun()
+    run_journaled(second, files, Journal(str(tmp_path), "act", "run1"), Manifest(str(tmp_path)), incremental=True)
+    assert second.seen == [files[1]]
+
+def test_resume_moves_finished_files_into_the_manifest(tmp_path):
+    files = make_files(tmp_path, ["a", "b"])
+    # Simulates a crash after the journal was synced but before the manifest was saved
+    journal = Journal(str(tmp_path), "act", "run1")
+    journal.record(FileResult(files[0], True))
+    journal.close()
+
+    resumed = FakeRun()
+    run_journaled(resumed, files, Journal(str(tmp_path), "act", "run1"), Manifest(str(tmp_path)), incremental=True, resume=True)
+    assert resumed.seen == [files[1]]
+    manifest = Manifest(str(tmp_path))
+    assert all(manifest.is_current(path, "act", "run1") for path in files)
+
+def test_missing_outputs_are_processed_again(tmp_path):
+    files = make_files(tmp_path, ["a", "b"])
+    outputs_for = lambda path: [path + ".out"]
+    for path in files:
+        open(path + ".out", 'w').close()
+    run_journaled(FakeRun(), files, Journal(str(tmp_path), "act", "run1"), Manifest(str(tmp_path)), True, outputs_for)
+
+    os.remove(files[0] + ".out")
+    again = FakeRun()
+    run_journaled(again, files, Journal(str(tmp_path), "act", "run1"), Manifest(str(tmp_path)), True, outputs_for)
+    assert again.seen == [files[0]]
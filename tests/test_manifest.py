@@ -0,0 +1,94 @@
+import os
+from manifest import Manifest, hash_params, get_file_signature
+
+
+def write_file(path, content="data"):
+    path.write_text(content)
+    return str(path)
+
+def bump_mtime(path):
+    stat_info = os.stat(path)
+    os.utime(path, ns=(stat_info.st_atime_ns, stat_info.st_mtime_ns + 1_000_000_000))
+
+def recorded(directory, files, action="act", params_hash="p1"):
+    manifest = Manifest(str(directory))
+    for path in files:
+        manifest.record(path, action, params_hash)
+    manifest.save()
+    return Manifest(str(directory))
+
+def test_hash_params_depends_on_action_and_values():
+    assert hash_params("act", {"a": 1, "b": 2}) == hash_params("act", {"b": 2, "a": 1})
+    assert hash_params("act", {"a": 1}) != hash_params("act", {"a": 2})
+    assert hash_params("act", {"a": 1}) != hash_params("other", {"a": 1})
+
+def test_recorded_file_is_current_after_reload(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    manifest = recorded(tmp_path, [path])
+    assert manifest.is_current(path, "act", "p1")
+    assert manifest.filter_changed([path], "act", "p1") == {}
+
+def test_modified_file_is_processed_again(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    manifest = recorded(tmp_path, [path])
+    bump_mtime(path)
+    assert not manifest.is_current(path, "act", "p1")
+    write_file(tmp_path / "a.jpg", "longer data")
+    assert list(manifest.filter_changed([path], "act", "p1")) == [path]
+
+def test_other_parameters_or_actions_are_processed_again(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    manifest = recorded(tmp_path, [path])
+    assert list(manifest.filter_changed([path], "act", "p2")) == [path]
+    assert list(manifest.filter_changed([path], "other", "p1")) == [path]
+
+def test_missing_output_invalidates_the_entry(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    output = write_file(tmp_path / "a_out.jpg")
+    manifest = recorded(tmp_path, [path])
+    outputs_for = lambda source: [output]
+    assert manifest.filter_changed([path], "act", "p1", outputs_for) == {}
+    os.remove(output)
+    assert list(manifest.filter_changed([path], "act", "p1", outputs_for)) == [path]
+
+def test_change_drops_results_and_hashes_of_the_old_content(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    manifest = Manifest(str(tmp_path))
+    manifest.record(path, "act", "p1")
+    manifest.record_hash(path, "sha256", "abc")
+    assert manifest.get_hash(path, "sha256") == "abc"
+
+    write_file(tmp_path / "a.jpg", "new content")
+    assert manifest.get_hash(path, "sha256") is None
+    manifest.record(path, "other", "p1")
+    assert not manifest.is_current(path, "act", "p1")
+    assert manifest.get_hash(path, "sha256") is None
+
+def test_aggregate_follows_inputs_and_outputs(tmp_path):
+    files = [write_file(tmp_path / name) for name in ("a.jpg", "b.jpg")]
+    output = write_file(tmp_path / "merged.jpg")
+    manifest = Manifest(str(tmp_path))
+    digest = manifest.inputs_digest(files, "p1")
+    manifest.record_aggregate("merge", digest)
+    assert manifest.is_aggregate_current("merge", manifest.inputs_digest(files, "p1"), [output])
+
+    assert not manifest.is_aggregate_current("merge", manifest.inputs_digest(files, "p2"), [output])
+    assert not manifest.is_aggregate_current("merge", manifest.inputs_digest(files[:1], "p1"), [output])
+    bump_mtime(files[1])
+    assert not manifest.is_aggregate_current("merge", manifest.inputs_digest(files, "p1"), [output])
+    os.remove(output)
+    assert not manifest.is_aggregate_current("merge", digest, [output])
+
+def test_unreadable_manifest_starts_empty(tmp_path):
+    path = write_file(tmp_path / "a.jpg")
+    manifest = recorded(tmp_path, [path])
+    with open(manifest.path, 'w') as f:
+        f.write("{not json")
+    assert not Manifest(str(tmp_path)).is_current(path, "act", "p1")
+
+def test_file_signature_tracks_edits(tmp_path):
+    path = write_file(tmp_path / "logo.png")
+    before = get_file_signature(path)
+    bump_mtime(path)
+    assert get_file_signature(path) != before
+    assert get_file_signature(str(tmp_path / "missing.png")) is None
@@ -0,0 +1,105 @@
+import os
+import pytest
+from PyPDF2 import PdfReader
+from PyPDF2.generic import NullObject
+from conftest import write_pdf
+from pdf_utils import StreamingPdfWriter, open_pdf, parse_page_ranges
+from actions.merge import merge_pdfs
+
+
+def write_streamed(path, sources, dedup_resources=True):
+    writer = StreamingPdfWriter(str(path), dedup_resources)
+    for source in sources:
+        handle, reader = open_pdf(source)
+        try:
+            for page_index in range(len(reader.pages)):
+                writer.add_page_from(reader, page_index)
+            writer.forget_reader(reader)
+        finally:
+            handle.close()
+    writer.close()
+    return writer
+
+def page_texts(path):
+    return [page.extract_text().strip() for page in PdfReader(str(path)).pages]
+
+@pytest.mark.parametrize("page_ranges, expected", [
+    ("", [0, 1, 2, 3, 4]),
+    ("1-2,4", [0, 1, 3]),
+    ("3-", [2, 3, 4]),
+    ("4-9", [3, 4])
+])
+def test_parse_page_ranges(page_ranges, expected):
+    assert parse_page_ranges(page_ranges, 5) == expected
+
+def test_bad_page_range_is_rejected():
+    with pytest.raises(ValueError):
+        parse_page_ranges("3-1", 5)
+
+def test_pages_are_flushed_as_they_are_added(tmp_path):
+    source = write_pdf(tmp_path / "a.pdf", pages=2)
+    writer = StreamingPdfWriter(str(tmp_path / "out.pdf"))
+    handle, reader = open_pdf(source)
+    try:
+        writer.add_page_from(reader, 0)
+        size = writer.tell()
+        assert size > 0
+        # Only placeholders stay in memory for what was written
+        flushed = [obj for idnum, obj in enumerate(writer._objects, 1) if idnum not in writer.reserved]
+        assert flushed and all(isinstance(obj, NullObject) for obj in flushed)
+        writer.add_page_from(reader, 1)
+        assert writer.tell() > size
+    finally:
+        handle.close()
+    writer.close()
+    assert page_texts(tmp_path / "out.pdf") == ["page 1", "page 2"]
+
+def test_identical_resources_are_written_once(tmp_path):
+    sources = [write_pdf(tmp_path / f"{name}.pdf", pages=2) for name in ("a", "b")]
+    shared = write_streamed(tmp_path / "shared.pdf", sources)
+    plain = write_streamed(tmp_path / "plain.pdf", sources, dedup_resources=False)
+
+    assert shared.deduplicated > 0 and plain.deduplicated == 0
+    assert os.path.getsize(tmp_path / "shared.pdf") < os.path.getsize(tmp_path / "plain.pdf")
+    reader = PdfReader(str(tmp_path / "shared.pdf"))
+    forms = {page["/Resources"]["/XObject"].raw_get("/Fx").idnum for page in reader.pages}
+    assert len(forms) == 1
+    assert page_texts(tmp_path / "shared.pdf") == ["page 1", "page 2"] * 2
+
+def test_abort_removes_the_partial_file(tmp_path):
+    writer = StreamingPdfWriter(str(tmp_path / "out.pdf"))
+    writer.abort()
+    assert not os.path.exists(tmp_path / "out.pdf")
+
+def test_merge_applies_page_ranges_per_file(tmp_path):
+    sources = [write_pdf(tmp_path / f"{name}.pdf", pages=3) for name in ("a", "b")]
+    output = tmp_path / "out"
+    output.mkdir()
+    assert merge_pdfs(sources, str(output), "a.pdf:2-;b.pdf:1") == [str(output / "merged_file.pdf")]
+    assert page_texts(output / "merged_file.pdf") == ["page 2", "page 3", "page 1"]
+
+def test_merge_splits_parts_and_removes_stale_ones(tmp_path):
+    sources = [write_pdf(tmp_path / f"{name}.pdf", pages=2) for name in ("a", "b")]
+    output = tmp_path / "out"
+    output.mkdir()
+    # A tiny cap starts a new part after every page
+    outputs = merge_pdfs(sources, str(output), max_part_size=0.0001)
+    assert [os.path.basename(path) for path in outputs] == ["merged_file.pdf", "merged_file_part2.pdf", "merged_file_part3.pdf", "merged_file_part4.pdf"]
+
+    merge_pdfs(sources[:1], str(output))
+    assert sorted(os.listdir(output)) == ["merged_file.pdf"]
+    assert page_texts(output / "merged_file.pdf") == ["page 1", "page 2"]
+
+def test_failed_merge_keeps_the_previous_output(tmp_path):
+    source = write_pdf(tmp_path / "a.pdf", pages=2)
+    output = tmp_path / "out"
+    output.mkdir()
+    merge_pdfs([source], str(output))
+    with open(output / "merged_file.pdf", 'rb') as f:
+        before = f.read()
+
+    with pytest.raises(Exception):
+        merge_pdfs([source, str(tmp_path / "missing.pdf")], str(output))
+    with open(output / "merged_file.pdf", 'rb') as f:
+        assert f.read() == before
+    assert os.listdir(output) == ["merged_file.pdf"]
@@ -0,0 +1,40 @@
+import os
+import pytest
+from PyPDF2 import PdfReader
+from conftest import write_pdf
+from actions.watermark import apply_pdf_watermark, get_watermark_output_path
+
+
+def watermark_pdf(path, watermark):
+    apply_pdf_watermark(path, watermark, None, False, "bottom_center", "bottom_center", 10, 20, "")
+    return get_watermark_output_path(path)
+
+@pytest.mark.parametrize("shared_resources", [False, True])
+def test_every_page_is_stamped(tmp_path, watermark_file, shared_resources):
+    source = write_pdf(tmp_path / "doc.pdf", pages=3, shared_resources=shared_resources)
+    output = watermark_pdf(source, watermark_file)
+
+    reader = PdfReader(output)
+    assert len(reader.pages) == 3
+    for index, page in enumerate(reader.pages):
+        xobjects = page["/Resources"]["/XObject"]
+        # The page keeps its own resources next to the stamp
+        assert set(xobjects) == {"/Fx", "/FPWatermark"}
+        assert page["/Resources"]["/Font"]["/F1"]["/BaseFont"] == "/Helvetica"
+        assert f"page {index + 1}" in page.extract_text()
+        assert len(page["/Contents"]) == 3
+
+def test_source_and_shared_resources_are_untouched(tmp_path, watermark_file):
+    source = write_pdf(tmp_path / "doc.pdf", pages=2)
+    with open(source, 'rb') as f:
+        before = f.read()
+    watermark_pdf(source, watermark_file)
+    with open(source, 'rb') as f:
+        assert f.read() == before
+    assert "/FPWatermark" not in PdfReader(source).pages[0]["/Resources"]["/XObject"]
+
+def test_failed_watermark_leaves_no_output(tmp_path):
+    source = write_pdf(tmp_path / "doc.pdf")
+    with pytest.raises(Exception):
+        watermark_pdf(source, str(tmp_path / "missing.png"))
+    assert sorted(os.listdir(tmp_path)) == ["doc.pdf"]
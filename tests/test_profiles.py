@@ -0,0 +1,33 @@
+import json
+import pytest
+from PIL import Image
+from conftest import write_image
+from actions.profiles import load_profiles, apply_profiles_to_file, get_profile_output_path
+
+
+def write_profiles(path, profiles):
+    path.write_text(json.dumps(profiles))
+    return str(path)
+
+@pytest.mark.parametrize("max_size, expected", [
+    (800, [800, 800]),
+    ("800", [800, 800]),
+    ("800x600", [800, 600]),
+    ([800, 600], [800, 600]),
+    (None, None)
+])
+def test_max_size_forms(tmp_path, max_size, expected):
+    profiles = load_profiles(write_profiles(tmp_path / "profiles.json", [{"name": "web", "max_size": max_size}]))
+    assert profiles[0]["max_size"] == expected
+
+@pytest.mark.parametrize("max_size", ["800x", "abc", "1x2x3", 0, True])
+def test_bad_max_size_is_rejected_at_load_time(tmp_path, max_size):
+    with pytest.raises(ValueError, match="max_size"):
+        load_profiles(write_profiles(tmp_path / "profiles.json", [{"name": "web", "max_size": max_size}]))
+
+def test_single_number_fits_a_square_box(tmp_path):
+    source = write_image(tmp_path / "photo.jpg", size=(120, 60))
+    profiles = load_profiles(write_profiles(tmp_path / "profiles.json", [{"name": "thumb", "max_size": "40"}]))
+    apply_profiles_to_file(source, profiles)
+    with Image.open(get_profile_output_path(source, profiles[0])) as output:
+        assert output.size == (40, 20)
@@ -0,0 +1,69 @@
+import os
+import pytest
+from PIL import Image
+from conftest import write_image
+from actions.watermark import apply_soft_edges, get_soft_edge_value, SOFT_EDGE_FALLOFFS, run_watermark, get_watermark_output_path
+from config import DEFAULT_SOFT_EDGE_WIDTH
+
+SIZES = [(1, 1), (1, 7), (7, 1), (2, 2), (3, 5), (17, 9), (64, 48), (101, 103), (150, 120)]
+
+
+def legacy_soft_edge_mask(width, height):
+    # The per-pixel loop apply_soft_edges used before it was vectorised
+    mask = Image.new('L', (width, height), 0)
+    for i in range(width):
+        for j in range(height):
+            distance = min(i, j, width - i, height - j)
+            mask.putpixel((i, j), max(0, min(255, distance * 5)))
+    return mask
+
+def reference_soft_edge_mask(width, height, feather, falloff):
+    # The same loop with the configurable feather and falloff
+    mask = Image.new('L', (width, height), 0)
+    for i in range(width):
+        for j in range(height):
+            mask.putpixel((i, j), get_soft_edge_value(min(i, j, width - i, height - j), feather, falloff))
+    return mask
+
+def soft_edge_mask(width, height, **kwargs):
+    image = Image.new('RGBA', (width, height), (10, 20, 30, 255))
+    return apply_soft_edges(image, **kwargs).getchannel('A')
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_default_mask_matches_legacy_loop(size):
+    assert DEFAULT_SOFT_EDGE_WIDTH == 51
+    assert soft_edge_mask(*size).tobytes() == legacy_soft_edge_mask(*size).tobytes()
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("feather", [0, 1, 4, 51, 200])
+@pytest.mark.parametrize("falloff", sorted(SOFT_EDGE_FALLOFFS))
+def test_mask_matches_reference_loop(size, feather, falloff):
+    # 200 is wider than half of every size, so no pixel reaches full opacity
+    expected = reference_soft_edge_mask(*size, feather, falloff)
+    assert soft_edge_mask(*size, feather=feather, falloff=falloff).tobytes() == expected.tobytes()
+
+def test_soft_edges_keep_color_channels():
+    image = Image.new('RGBA', (9, 5), (10, 20, 30, 255))
+    result = apply_soft_edges(image)
+    assert result.size == (9, 5)
+    assert result.convert('RGB').getpixel((4, 2)) == (10, 20, 30)
+
+def test_unknown_falloff_is_rejected():
+    with pytest.raises(ValueError):
+        soft_edge_mask(5, 5, falloff="unknown")
+
+def test_edited_watermark_file_is_reloaded(tmp_path, watermark_file):
+    source = write_image(tmp_path / "photo.png", size=(100, 100), color=(255, 255, 255))
+    output = get_watermark_output_path(source)
+    colors = []
+    for color in ((0, 0, 255, 255), (255, 0, 0, 255)):
+        Image.new('RGBA', (20, 20), color).save(watermark_file)
+        # Same size, so only the mtime tells the two versions apart
+        stat_info = os.stat(watermark_file)
+        os.utime(watermark_file, ns=(stat_info.st_atime_ns, stat_info.st_mtime_ns + len(colors) * 1_000_000_000))
+        results = run_watermark([source], watermark_file, size=50, soft_edge=False, workers=1)
+        assert results[0].success
+        with Image.open(output) as image:
+            colors.append(image.convert('RGB').getpixel((50, 90)))
+    assert colors[0] != colors[1]
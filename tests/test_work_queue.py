@@ -0,0 +1,103 @@
+import os
+from executor import FileResult
+from conftest import write_image
+from work_queue import WorkQueue, submit_run, run_worker
+from actions.watermark import get_watermark_output_path
+
+
+def make_queue(tmp_path):
+    return WorkQueue(str(tmp_path / "queue.db"))
+
+def make_files(directory, count):
+    directory.mkdir(exist_ok=True)
+    return [str(directory / f"file{index}.jpg") for index in range(count)]
+
+def unit_statuses(queue):
+    return [status for (status,) in queue.connection.execute("SELECT status FROM units ORDER BY id")]
+
+def test_submit_splits_files_into_units(tmp_path):
+    queue = make_queue(tmp_path)
+    files = make_files(tmp_path / "in", 5)
+    run_id, units = queue.submit("apply_watermark", str(tmp_path / "in"), {}, files, shard_size=2)
+    assert units == 3
+    unit = queue.claim("w1")
+    assert unit["run_id"] == run_id
+    assert unit["files"] == ["file0.jpg", "file1.jpg"]
+    assert unit["attempt"] == 1
+
+def test_leased_unit_is_not_handed_out_twice(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, make_files(tmp_path / "in", 1))
+    assert queue.claim("w1", lease_seconds=60) is not None
+    assert queue.claim("w2", lease_seconds=60) is None
+    assert queue.has_open_units()
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, make_files(tmp_path / "in", 1))
+    first = queue.claim("w1", lease_seconds=-1)
+    second = queue.claim("w2", lease_seconds=60)
+    assert second["id"] == first["id"]
+    assert second["attempt"] == 2
+    # The worker that lost its lease can no longer complete the unit
+    queue.complete(first, "w1", [FileResult(first["files"][0], True)])
+    assert unit_statuses(queue) == ["leased"]
+
+def test_failed_files_are_retried_alone(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, make_files(tmp_path / "in", 2))
+    unit = queue.claim("w1")
+    status = queue.complete(unit, "w1", [FileResult("file0.jpg", True), FileResult("file1.jpg", False, "boom")])
+    assert status == "pending"
+
+    retry = queue.claim("w1")
+    assert retry["files"] == ["file1.jpg"]
+    assert queue.complete(retry, "w1", [FileResult("file1.jpg", True)]) == "done"
+    run = queue.status()["runs"][0]
+    assert run["files_succeeded"] == 2 and run["files_failed"] == 0
+
+def test_unit_fails_after_its_last_attempt(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, make_files(tmp_path / "in", 1))
+    for attempt in range(2):
+        unit = queue.claim("w1", max_attempts=2)
+        status = queue.complete(unit, "w1", [FileResult("file0.jpg", False, "boom")], max_attempts=2)
+    assert status == "failed"
+    assert queue.claim("w1", max_attempts=2) is None
+    assert not queue.has_open_units()
+
+def test_lease_lost_on_the_last_attempt_marks_the_unit_failed(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, make_files(tmp_path / "in", 1))
+    queue.claim("w1", lease_seconds=-1, max_attempts=1)
+    assert queue.expire_leases(max_attempts=1) == 1
+    assert unit_statuses(queue) == ["failed"]
+    assert not queue.has_open_units()
+
+def test_resubmitting_queues_only_new_and_failed_files(tmp_path):
+    queue = make_queue(tmp_path)
+    files = make_files(tmp_path / "in", 2)
+    queue.submit("apply_watermark", str(tmp_path / "in"), {}, files)
+    unit = queue.claim("w1")
+    queue.complete(unit, "w1", [FileResult("file0.jpg", True), FileResult("file1.jpg", False, "boom")], max_attempts=1)
+
+    assert queue.submit("apply_watermark", str(tmp_path / "in"), {}, files)[1] == 1
+    assert queue.claim("w1")["files"] == ["file1.jpg"]
+    # Open units are left alone, only the new file gets a unit
+    files.append(str(tmp_path / "in" / "file2.jpg"))
+    assert queue.submit("apply_watermark", str(tmp_path / "in"), {}, files)[1] == 1
+    assert queue.claim("w2")["files"] == ["file2.jpg"]
+    # Other parameters are a separate run
+    assert queue.submit("apply_watermark", str(tmp_path / "in"), {"size": 5}, files)[1] == 1
+
+def test_worker_drains_the_queue(tmp_path, watermark_file):
+    directory = tmp_path / "in"
+    directory.mkdir()
+    sources = [write_image(directory / f"photo{index}.jpg") for index in range(3)]
+    queue_path = str(tmp_path / "queue.db")
+    submit_run(queue_path, "apply_watermark", str(directory), {"watermark": watermark_file, "workers": 1}, shard_size=2)
+
+    summary = run_worker(queue_path, "w1")
+    assert summary["units"] == 2
+    assert summary["files_succeeded"] == 3
+    assert all(os.path.exists(get_watermark_output_path(source)) for source in sources)
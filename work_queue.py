@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import inspect
+import logging
+import importlib
+import threading
+from file_utils import iter_files
+from manifest import hash_params
+from config import (
+    DEFAULT_SHARD_SIZE,
+    DEFAULT_LEASE_SECONDS,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_POLL_INTERVAL,
+    IMAGE_EXTENSIONS,
+    PDF_EXTENSIONS
+)
+
+# Actions that produce one output per input and can therefore be split into work units:
+# action name -> (module, function taking a list of files and returning FileResults, input extensions)
+SHARDABLE_ACTIONS = {
+    "apply_watermark": ("actions.watermark", "run_watermark", IMAGE_EXTENSIONS + PDF_EXTENSIONS),
+    "apply_watermark_profiles": ("actions.profiles", "run_profiles", IMAGE_EXTENSIONS)
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    action TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    params TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    files TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS units_status ON units (status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    unit_id INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    error TEXT,
+    worker TEXT,
+    updated REAL,
+    PRIMARY KEY (run_id, path)
+);
+"""
+
+
+class WorkQueue:
+    # SQLite-backed queue of leased work units. Every state change is a short transaction, so
+    # any number of worker processes (or hosts sharing the file) can claim units concurrently.
+    # A crashed worker's lease simply expires and the unit is handed out again.
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same unit
+        return _Transaction(self.connection)
+
+    def submit(self, action, directory, params, files, shard_size=DEFAULT_SHARD_SIZE):
+        # Submitting the same action, directory and parameters again adds to the existing run: files already
+        # in a pending, leased or done unit (or already succeeded) are left alone, so an open run is simply
+        # resumed, while files added since, and those of units that failed for good, get new units.
+        run_id = hash_params(action, {"directory": os.path.abspath(directory), "params": params})
+        # Discovery finishes before the write lock is taken, so workers are never blocked by a slow scan.
+        # Paths are stored relative to the run directory, so hosts may mount it elsewhere.
+        paths = [os.path.relpath(file, directory) for file in files]
+        with self.transaction() as cursor:
+            exists = cursor.execute("SELECT 1 FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if exists:
+                queued = {path for (path,) in cursor.execute("SELECT path FROM results WHERE run_id = ? AND success = 1", (run_id,))}
+                for (unit_files,) in cursor.execute("SELECT files FROM units WHERE run_id = ? AND status != 'failed'", (run_id,)):
+                    queued.update(json.loads(unit_files))
+                paths = [path for path in paths if path not in queued]
+            else:
+                cursor.execute("INSERT INTO runs (id, action, directory, params, created) VALUES (?, ?, ?, ?, ?)", (run_id, action, os.path.abspath(directory), json.dumps(params), time.time()))
+            shards = [paths[start:start + shard_size] for start in range(0, len(paths), shard_size)]
+            now = time.time()
+            cursor.executemany("INSERT INTO units (run_id, files, updated) VALUES (?, ?, ?)", [(run_id, json.dumps(shard), now) for shard in shards])
+        if exists:
+            logging.info(f"Run {run_id} already queued, added {len(shards)} work units for {len(paths)} new or failed files")
+        else:
+            logging.info(f"Queued run {run_id}: {len(shards)} work units for {action} in {directory}")
+        return run_id, len(shards)
+
+    def expire_leases(self, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        # A worker that died on a unit's last attempt (e.g. killed for running out of memory on the same
+        # file every time) never reports back; once its lease runs out the unit is marked failed
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE units SET status = 'failed', lease_owner = NULL, lease_expires = NULL, error = ?, updated = ? "
+                "WHERE attempts >= ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))",
+                ("Worker stopped responding on the last attempt", now, max_attempts, now)
+            )
+            return cursor.rowcount
+
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        now = time.time()
+        with self.transaction() as cursor:
+            row = cursor.execute(
+                "SELECT units.id, units.run_id, units.files, units.attempts, runs.action, runs.directory, runs.params FROM units JOIN runs ON runs.id = units.run_id "
+                "WHERE (units.status = 'pending' OR (units.status = 'leased' AND units.lease_expires < ?)) AND units.attempts < ? ORDER BY units.id LIMIT 1",
+                (now, max_attempts)
+            ).fetchone()
+            if row is None:
+                return None
+            unit_id, run_id, files, attempts, action, directory, params = row
+            cursor.execute("UPDATE units SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?", (worker_id, now + lease_seconds, now, unit_id))
+            # Files that already succeeded in an earlier attempt are not processed again
+            done = {path for (path,) in cursor.execute("SELECT path FROM results WHERE run_id = ? AND success = 1", (run_id,))}
+        files = [file for file in json.loads(files) if file not in done]
+        return {"id": unit_id, "run_id": run_id, "files": files, "attempt": attempts + 1, "action": action, "directory": directory, "params": json.loads(params)}
+
+    def renew(self, unit_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE units SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'", (time.time() + lease_seconds, unit_id, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, unit, worker_id, results, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        now = time.time()
+        failed = [result for result in results if not result.success]
+        with self.transaction() as cursor:
+            for result in results:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO results (run_id, path, unit_id, success, skipped, error, worker, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (unit["run_id"], result.path, unit["id"], int(result.success), int(result.skipped), result.error, worker_id, now)
+                )
+            if not failed:
+                status = 'done'
+            elif unit["attempt"] >= max_attempts:
+                status = 'failed'
+            else:
+                status = 'pending'  # Retried later, only the failed files are processed again
+            error = failed[0].error if failed else None
+            cursor.execute("UPDATE units SET status = ?, lease_owner = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ? AND lease_owner = ?", (status, error, now, unit["id"], worker_id))
+        return status
+
+    def release(self, unit, worker_id, error, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        # The whole unit failed (e.g. the action could not be loaded)
+        status = 'failed' if unit["attempt"] >= max_attempts else 'pending'
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE units SET status = ?, lease_owner = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ? AND lease_owner = ?", (status, error, time.time(), unit["id"], worker_id))
+        return status
+
+    def has_open_units(self):
+        # Leased units count until they finish or expire_leases marks them failed
+        row = self.connection.execute("SELECT COUNT(*) FROM units WHERE status IN ('pending', 'leased')").fetchone()
+        return row[0] > 0
+
+    def status(self):
+        runs = []
+        for run_id, action, directory in self.connection.execute("SELECT id, action, directory FROM runs ORDER BY created"):
+            units = dict(self.connection.execute("SELECT status, COUNT(*) FROM units WHERE run_id = ? GROUP BY status", (run_id,)).fetchall())
+            files = self.connection.execute("SELECT SUM(success), SUM(1 - success), SUM(skipped) FROM results WHERE run_id = ?", (run_id,)).fetchone()
+            runs.append({
+                "run_id": run_id,
+                "action": action,
+                "directory": directory,
+                "units": units,
+                "files_succeeded": files[0] or 0,
+                "files_failed": files[1] or 0,
+                "files_skipped": files[2] or 0
+            })
+        return {"queue": self.path, "runs": runs}
+
+
+class _Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+class LeaseKeeper:
+    # Renews the lease in the background while a unit is processed, so long units are not handed out twice
+    def __init__(self, queue_path, unit_id, worker_id, lease_seconds):
+        self.queue_path = queue_path
+        self.unit_id = unit_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        # SQLite connections must not be shared between threads
+        queue = WorkQueue(self.queue_path)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not queue.renew(self.unit_id, self.worker_id, self.lease_seconds):
+                    logging.warning(f"Lost the lease on work unit {self.unit_id}")
+        finally:
+            queue.close()
+
+
+def discover_action_files(action, directory, include_subdirectories=True):
+    if action not in SHARDABLE_ACTIONS:
+        raise ValueError(f"Action {action} cannot be split into work units, supported actions: {', '.join(SHARDABLE_ACTIONS)}")
+    extensions = SHARDABLE_ACTIONS[action][2]
+    return (entry.path for entry in iter_files(directory, include_subdirectories, extensions=extensions, skip_generated=True))
+
+def submit_run(queue_path, action, directory, params, shard_size=DEFAULT_SHARD_SIZE):
+    files = discover_action_files(action, directory, params.get("include_subdirectories", True))
+    queue = WorkQueue(queue_path)
+    try:
+        return queue.submit(action, directory, params, files, shard_size)
+    finally:
+        queue.close()
+
+def run_unit(unit, directory=None):
+    module_name, function_name, _ = SHARDABLE_ACTIONS[unit["action"]]
+    run_function = getattr(importlib.import_module(module_name), function_name)
+    # Only pass the parameters the per-file runner understands (directory-level flags like incremental are dropped)
+    accepted = inspect.signature(run_function).parameters
+    params = {key: value for key, value in unit["params"].items() if key in accepted and key != "files"}
+    base_directory = directory or unit["directory"]
+    paths = {os.path.join(base_directory, file): file for file in unit["files"]}
+    results = run_function(list(paths), **params)
+    for result in results:
+        result.path = paths.get(result.path, result.path)
+    return results
+
+def run_worker(queue_path, worker_id=None, directory=None, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, poll_interval=DEFAULT_POLL_INTERVAL, wait=False):
+    # Claims units until the queue is drained; with wait=True it keeps polling for new submissions
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue = WorkQueue(queue_path)
+    summary = {"worker": worker_id, "units": 0, "units_failed": 0, "files_succeeded": 0, "files_failed": 0, "files_skipped": 0}
+    try:
+        while True:
+            expired = queue.expire_leases(max_attempts)
+            if expired:
+                logging.error(f"Marked {expired} work units as failed after their last attempt's lease expired")
+                summary["units_failed"] += expired
+            unit = queue.claim(worker_id, lease_seconds, max_attempts)
+            if unit is None:
+                if wait or queue.has_open_units():
+                    # Other workers still hold leases that may expire and need picking up
+                    time.sleep(poll_interval)
+                    continue
+                break
+            logging.info(f"Worker {worker_id} claimed work unit {unit['id']} (attempt {unit['attempt']}, {len(unit['files'])} files)")
+            try:
+                with LeaseKeeper(queue_path, unit["id"], worker_id, lease_seconds):
+                    results = run_unit(unit, directory)
+            except Exception as e:
+                logging.error(f"Work unit {unit['id']} failed: {str(e)}")
+                if queue.release(unit, worker_id, str(e), max_attempts) == 'failed':
+                    summary["units_failed"] += 1
+                continue
+            status = queue.complete(unit, worker_id, results, max_attempts)
+            summary["units"] += 1
+            if status == 'failed':
+                summary["units_failed"] += 1
+            for result in results:
+                if not result.success:
+                    summary["files_failed"] += 1
+                elif result.skipped:
+                    summary["files_skipped"] += 1
+                else:
+                    summary["files_succeeded"] += 1
+            logging.info(f"Work unit {unit['id']} finished as {status}")
+    finally:
+        queue.close()
+    return summary